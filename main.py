@@ -1,255 +1,1865 @@
+import time
+# Measured from here: everything before the first dialog counts as startup
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import pandas as pd
-import pdfplumber
 import re
 import os
 import sys
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
-from openpyxl.utils.dataframe import dataframe_to_rows
+import cProfile
+import hashlib
+import json
+import multiprocessing
+import queue
+import sqlite3
+import threading
+import tracemalloc
+import unicodedata
+from array import array
+from bisect import bisect_right
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+# pandas, numpy, pdfplumber and openpyxl are imported inside the functions that
+# use them, so the first dialog appears without waiting for them (see _warm_up).
+
+# PDF extraction settings
+# MACHING_PDF_WORKERS: number of worker processes (0 = one per CPU, 1 = serial)
+PDF_WORKERS = int(os.environ.get("MACHING_PDF_WORKERS", "0"))
+# Files with fewer pages than this are always extracted serially
+PARALLEL_MIN_PAGES = int(os.environ.get("MACHING_PARALLEL_MIN_PAGES", "16"))
+# MACHING_PDF_ENGINE: "words" (pdfplumber extract_words, default) or "chars"
+# (NumPy word and line grouping on page.chars); both give the same records
+PDF_ENGINE = os.environ.get("MACHING_PDF_ENGINE", "words")
+PDF_ENGINES = ("words", "chars")
+
+# Extraction cache settings
+# Bump PARSER_VERSION whenever the parsing logic changes so stale entries are ignored
+PARSER_VERSION = "3"
+# MACHING_PDF_CACHE=0 disables the cache
+PDF_CACHE_ENABLED = os.environ.get("MACHING_PDF_CACHE", "1") != "0"
+PDF_CACHE_MAX_BYTES = int(os.environ.get("MACHING_PDF_CACHE_MAX_MB", "200")) * 1024 * 1024
+PDF_CACHE_COLUMNS = ['pdf_code', 'pdf_name', 'pdf_cost']
+
+# Startup diagnostics are written to stderr (when there is one) and to MACHING_LOG if set
+LOG_PATH = os.environ.get("MACHING_LOG")
+
+def _log(message):
+    line = f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+    if sys.stderr is not None:
+        print(line, file=sys.stderr)
+    if LOG_PATH:
+        try:
+            with open(LOG_PATH, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+
+def _import_heavy_modules():
+    t0 = time.perf_counter()
+    import numpy
+    import pandas
+    import pdfplumber
+    import openpyxl
+    _log(f"heavy imports: {time.perf_counter() - t0:.3f}s")
+
+def _warm_up():
+    # Import the heavy modules in the background while the user picks files.
+    # A later import in the main thread waits for this one instead of starting over.
+    thread = threading.Thread(target=_import_heavy_modules, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+_first_dialog_shown = False
 
-def select_file(title, filetypes):
+def select_file(title, filetypes, multiple=False):
+    # Returns the chosen path ("" if cancelled), or a list of paths when multiple is True
+    global _first_dialog_shown
     root = tk.Tk()
     root.withdraw()  # Hide the main window
+    if not _first_dialog_shown:
+        _first_dialog_shown = True
+        _log(f"time to first dialog: {time.perf_counter() - _STARTUP_T0:.3f}s")
+    if multiple:
+        return list(filedialog.askopenfilenames(title=title, filetypes=filetypes))
     file_path = filedialog.askopenfilename(title=title, filetypes=filetypes)
     return file_path
 
-def extract_pdf_data(pdf_path):
-    data = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            # Check if page contains the target header
-            if "科目別合計" not in page.extract_text():
+class ProgressWindow:
+    # Small window showing PDF extraction progress while the work runs in a
+    # background thread. The worker only puts page stats on a queue; all Tk
+    # calls stay in the main thread (polled with after()).
+    POLL_MS = 100
+
+    def __init__(self, title="Maching"):
+        self.queue = queue.Queue()
+        self.cancel = threading.Event()
+        self.pages_read = 0
+        self.records = 0
+        self.last_page = None
+        # Page count per PDF file, when several are read
+        self.files = {}
+
+        self.root = tk.Tk()
+        self.root.title(title)
+        self.root.resizable(False, False)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_cancel)
+        self.status = tk.Label(self.root, text="PDFを読み込んでいます...", width=40, anchor="w")
+        self.status.pack(padx=16, pady=(16, 4))
+        self.detail = tk.Label(self.root, text="", width=40, anchor="w")
+        self.detail.pack(padx=16, pady=4)
+        self.button = tk.Button(self.root, text="キャンセル", width=12, command=self._on_cancel)
+        self.button.pack(pady=(4, 16))
+
+    def on_page(self, stats):
+        # Called from the worker thread
+        self.queue.put(stats)
+
+    def wait(self, future, *others):
+        # Run the Tk loop until the future is done, then close the window.
+        # A failure of one of the other futures (e.g. the CSV read) ends the
+        # wait at once and cancels the extraction, so its error is not held
+        # back until the whole PDF has been read.
+        self.root.after(0, self._poll, future, others)
+        self.root.mainloop()
+        self.root.destroy()
+
+    def _poll(self, future, others=()):
+        while True:
+            try:
+                stats = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.pages_read += 1
+            self.records += stats["records"]
+            self.last_page = (stats["page"], stats["pages"])
+            self.files[stats.get("file", "")] = stats["pages"]
+        if len(self.files) > 1:
+            # Pages of several files arrive interleaved, so only totals are shown
+            self.detail.config(text=f"{len(self.files)} ファイル  読込 {self.pages_read} / {sum(self.files.values())} ページ"
+                                    f"  抽出件数 {self.records} 件")
+        elif self.last_page:
+            page, pages = self.last_page
+            self.detail.config(text=f"ページ {page} / {pages}（読込 {self.pages_read} ページ）  抽出件数 {self.records} 件")
+        if future.done():
+            self.root.quit()
+            return
+        if any(other.done() and (other.cancelled() or other.exception() is not None) for other in others):
+            self.cancel.set()
+            self.root.quit()
+            return
+        self.root.after(self.POLL_MS, self._poll, future, others)
+
+    def _on_cancel(self):
+        self.cancel.set()
+        self.status.config(text="キャンセルしています...")
+        self.button.config(state="disabled")
+
+SECTION_MARKER = "科目別合計"
+# Words whose 'top' differs by less than this belong to the same line
+LINE_TOLERANCE = 3
+
+def cluster_lines(words, tolerance=LINE_TOLERANCE):
+    # Sort once by 'top' and sweep words into bands. A band is anchored at
+    # its first (topmost) word. Returns lines top to bottom, each sorted by x0.
+    lines = []
+    line = []
+    line_top = None
+    for word in sorted(words, key=lambda w: w['top']):
+        if line and word['top'] - line_top < tolerance:
+            line.append(word)
+        else:
+            if line:
+                lines.append(line)
+            line = [word]
+            line_top = word['top']
+    if line:
+        lines.append(line)
+    return [sorted(line, key=lambda w: w['x0']) for line in lines]
+
+# Gap between two characters (x0 of the next minus x1 of the previous) that
+# starts a new word; the same default as extract_words()
+WORD_GAP = 3
+
+def chars_to_lines(chars, tolerance=LINE_TOLERANCE, gap=WORD_GAP):
+    # Same words as extract_words(), computed on arrays: rows are bands of
+    # chained 'top' values (as pdfplumber clusters them), words break on
+    # whitespace, on a gap wider than `gap` and on a step back in x. The words
+    # are then grouped by cluster_lines(). Returns None for rotated text, which
+    # is left to extract_words().
+    import numpy as np
+    if not chars:
+        return []
+    if not all(c['upright'] for c in chars):
+        return None
+    text = [c['text'] for c in chars]
+    x0 = np.fromiter((c['x0'] for c in chars), dtype=float, count=len(chars))
+    x1 = np.fromiter((c['x1'] for c in chars), dtype=float, count=len(chars))
+    top = np.fromiter((c['top'] for c in chars), dtype=float, count=len(chars))
+    space = np.fromiter((t.isspace() for t in text), dtype=bool, count=len(chars))
+
+    by_top = np.argsort(top, kind='stable')
+    row = np.empty(len(chars), dtype=np.int64)
+    row[by_top] = np.concatenate(([0], np.cumsum(np.diff(top[by_top]) > tolerance)))
+    # Row by row, left to right; lexsort is stable, so ties keep stream order
+    order = np.lexsort((x0, row))
+    x0, x1, top, row, space = x0[order], x1[order], top[order], row[order], space[order]
+
+    breaks = np.ones(len(order), dtype=bool)
+    breaks[1:] = ((row[1:] != row[:-1]) | space[:-1]
+                  | (x0[1:] < x0[:-1]) | (x0[1:] > x1[:-1] + gap)
+                  | (np.abs(top[1:] - top[:-1]) > tolerance))
+    keep = ~space
+    starts = np.flatnonzero((breaks & keep)[keep])
+    if not len(starts):
+        return []
+    kept = order[keep]
+    ends = np.append(starts[1:], len(kept))
+    word_x0 = np.minimum.reduceat(x0[keep], starts)
+    word_x1 = np.maximum.reduceat(x1[keep], starts)
+    word_top = np.minimum.reduceat(top[keep], starts)
+
+    words = [{
+        'text': "".join(text[j] for j in kept[start:end]),
+        'x0': float(word_x0[i]), 'x1': float(word_x1[i]), 'top': float(word_top[i]),
+    } for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))]
+    # The chained rows only decide the words, as in extract_words(); lines are
+    # the anchored bands of cluster_lines(), as for the "words" engine
+    return cluster_lines(words, tolerance)
+
+# Only characters this far from the top of the page are checked for the marker
+HEADER_BAND = float(os.environ.get("MACHING_HEADER_BAND", "150"))
+# MACHING_SECTION_SCAN: "backward" (default) reads pages from the end and stops
+# once the 科目別合計 section has started; "all" parses every page
+SECTION_SCAN = os.environ.get("MACHING_SECTION_SCAN", "backward")
+
+def _is_summary_page(page, header_band=None):
+    # Classify from the raw characters of the header band instead of
+    # extract_text(), which would run a full text layout pass. page.chars is
+    # cached on the page, so extract_words() builds on the same pass.
+    if header_band is None:
+        header_band = HEADER_BAND
+    return SECTION_MARKER in "".join(c['text'] for c in page.chars if c['top'] < header_band)
+
+NUMBER_RE = re.compile(r'^[\d,]+$')
+# Column header of one block in the 科目別合計 table; repeated per block on a line
+HEADER_BLOCK = ("仕入先", "仕入先", "原価", "COM")
+
+class ColumnModel:
+    # x-ranges of the 科目別合計 columns, learned from the header row of a page.
+    # Each block is (start, code_end, cost_start, com_start):
+    #   code:  x0 < code_end                 (left-aligned under the 1st 仕入先)
+    #   name:  between code and cost
+    #   cost:  x1 > cost_start               (right-aligned under 原価)
+    #   com:   x1 > com_start                (right-aligned under COM)
+    # A block starts halfway between the previous COM header and its own code header.
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.starts = [block[0] for block in blocks]
+
+    @classmethod
+    def from_header(cls, line_words):
+        texts = [w['text'] for w in line_words]
+        headers = []
+        idx = 0
+        while idx + len(HEADER_BLOCK) <= len(texts):
+            if tuple(texts[idx:idx + len(HEADER_BLOCK)]) == HEADER_BLOCK:
+                headers.append(line_words[idx:idx + len(HEADER_BLOCK)])
+                idx += len(HEADER_BLOCK)
+            else:
+                idx += 1
+        if not headers:
+            return None
+        blocks = []
+        prev_com = None
+        for code_hdr, _, cost_hdr, com_hdr in headers:
+            start = float('-inf') if prev_com is None else (prev_com['x1'] + code_hdr['x0']) / 2
+            blocks.append((start, code_hdr['x1'], cost_hdr['x0'], com_hdr['x0']))
+            prev_com = com_hdr
+        return cls(blocks)
+
+    def place(self, line_words):
+        # One linear pass: assign each word to (block, field) by its x position.
+        # Returns (records, ok); ok is False when part of the line did not fit the model.
+        fields = [{'code': [], 'name': [], 'cost': [], 'com': []} for _ in self.blocks]
+        for word in line_words:
+            b = bisect_right(self.starts, word['x0']) - 1
+            _, code_end, cost_start, com_start = self.blocks[b]
+            if word['x0'] < code_end:
+                field = 'code'
+            elif word['x1'] > com_start:
+                field = 'com'
+            elif word['x1'] > cost_start:
+                field = 'cost'
+            else:
+                field = 'name'
+            fields[b][field].append(word['text'])
+
+        data = []
+        ok = True
+        for block in fields:
+            if not any(block.values()):
                 continue
-                
-            words = page.extract_words()
-            # Group words by line (using 'top' coordinate)
-            lines = {}
-            for word in words:
-                top = word['top']
-                # Find existing line with similar top (tolerance of 3)
-                found_line = False
-                for line_top in lines:
-                    if abs(line_top - top) < 3:
-                        lines[line_top].append(word)
-                        found_line = True
-                        break
-                if not found_line:
-                    lines[top] = [word]
+            cost_text = "".join(block['cost'])
+            if len(block['code']) != 1 or not NUMBER_RE.match(cost_text):
+                ok = False
+                continue
+            data.append((block['code'][0], "".join(block['name']), int(cost_text.replace(',', ''))))
+        return data, ok
+
+def _parse_line_heuristic(line_words):
+    # Token-order parser, used when a page has no column header row
+    data = []
+    # Parse line words
+    # Expected pattern: Code -> Name (1+ words) -> Cost -> Com -> Repeat
+    
+    idx = 0
+    while idx < len(line_words):
+        # 1. Identify Code
+        # Code is usually alphanumeric.
+        # If we are at the end, break
+        if idx >= len(line_words):
+            break
             
-            # Sort lines by top (vertical order)
-            sorted_line_tops = sorted(lines.keys())
+        code_word = line_words[idx]
+        code = code_word['text']
+        idx += 1
+        
+        # 2. Identify Name and Cost
+        # Name can be multiple words. Cost is a number (digits and commas).
+        # Cost must be followed by Com (another number).
+        
+        name_parts = []
+        cost = None
+        
+        while idx < len(line_words):
+            word = line_words[idx]
+            text = word['text']
             
-            for top in sorted_line_tops:
-                line_words = sorted(lines[top], key=lambda w: w['x0'])
-                
-                # Filter out header lines
-                line_text = "".join([w['text'] for w in line_words])
-                if "科目別合計" in line_text or "仕入先" in line_text or "原価" in line_text:
-                    continue
-                
-                # Parse line words
-                # Expected pattern: Code -> Name (1+ words) -> Cost -> Com -> Repeat
+            # Check if this word is a potential Cost
+            # It must be a number, AND the NEXT word must also be a number (Com)
+            is_number = NUMBER_RE.match(text)
+            
+            is_cost = False
+            if is_number:
+                # Check next word
+                if idx + 1 < len(line_words):
+                    next_text = line_words[idx+1]['text']
+                    if NUMBER_RE.match(next_text):
+                        is_cost = True
+            
+            if is_cost:
+                cost = int(text.replace(',', ''))
+                idx += 1 # Consume Cost
                 
-                idx = 0
-                while idx < len(line_words):
-                    # 1. Identify Code
-                    # Code is usually alphanumeric.
-                    # If we are at the end, break
-                    if idx >= len(line_words):
-                        break
-                        
-                    code_word = line_words[idx]
-                    code = code_word['text']
+                # Consume Com
+                if idx < len(line_words):
+                    # com = int(line_words[idx]['text'].replace(',', '')) # We don't need Com but we consume it
                     idx += 1
-                    
-                    # 2. Identify Name and Cost
-                    # Name can be multiple words. Cost is a number (digits and commas).
-                    # Cost must be followed by Com (another number).
-                    
-                    name_parts = []
-                    cost = None
-                    
-                    while idx < len(line_words):
-                        word = line_words[idx]
-                        text = word['text']
-                        
-                        # Check if this word is a potential Cost
-                        # It must be a number, AND the NEXT word must also be a number (Com)
-                        is_number = re.match(r'^[\d,]+$', text)
-                        
-                        is_cost = False
-                        if is_number:
-                            # Check next word
-                            if idx + 1 < len(line_words):
-                                next_text = line_words[idx+1]['text']
-                                if re.match(r'^[\d,]+$', next_text):
-                                    is_cost = True
-                        
-                        if is_cost:
-                            cost = int(text.replace(',', ''))
-                            idx += 1 # Consume Cost
-                            
-                            # Consume Com
-                            if idx < len(line_words):
-                                # com = int(line_words[idx]['text'].replace(',', '')) # We don't need Com but we consume it
-                                idx += 1
-                            break
-                        else:
-                            name_parts.append(text)
-                            idx += 1
-                    
-                    if cost is not None:
-                        name = "".join(name_parts)
-                        data.append({
-                            'pdf_code': code,
-                            'pdf_name': name,
-                            'pdf_cost': cost
-                        })
-                    else:
-                        # If we didn't find a cost, this "Code" might have been garbage or end of line
-                        pass
-    return pd.DataFrame(data)
+                break
+            else:
+                name_parts.append(text)
+                idx += 1
+        
+        if cost is not None:
+            name = "".join(name_parts)
+            data.append((code, name, cost))
+        else:
+            # If we didn't find a cost, this "Code" might have been garbage or end of line
+            pass
+    return data
+
+def _page_lines(page, engine):
+    if engine == "chars":
+        lines = chars_to_lines(page.chars)
+        if lines is not None:
+            return lines
+    return cluster_lines(page.extract_words())
+
+def _parse_lines(lines, columns=None, page_number=None):
+    # Parse the lines of one 科目別合計 page. Returns (records, columns, carried,
+    # unplaced): columns is the ColumnModel in effect at the end of the page,
+    # carried is True when a data line was read before the page's own header
+    # row, i.e. with the `columns` passed in from the previous page.
+    data = []
+    unplaced = 0
+    in_table = False
+    own_header = False
+    carried = False
+    for line_words in lines:
+        # Filter out header lines (learning the columns from the table header)
+        line_text = "".join([w['text'] for w in line_words])
+        if SECTION_MARKER in line_text or "仕入先" in line_text or "原価" in line_text:
+            header = ColumnModel.from_header(line_words)
+            if header is not None:
+                columns = header
+                own_header = True
+            in_table = True
+            continue
+        # Lines above the 科目別合計 marker are the page header
+        if not in_table:
+            continue
+        carried = carried or not own_header
+        
+        if columns is None:
+            data.extend(_parse_line_heuristic(line_words))
+            continue
+        records, ok = columns.place(line_words)
+        data.extend(records)
+        if not ok:
+            unplaced += 1
+            _log(f"page {page_number}: could not place line: {' '.join(w['text'] for w in line_words)}")
+    return data, columns, carried, unplaced
+
+def _section_lines(page, stats=None, engine=None, header_band=None):
+    # The page's lines, or None for pages outside the 科目別合計 section.
+    # engine ("words" or "chars", default PDF_ENGINE) selects how lines are built,
+    # header_band (default HEADER_BAND) where the 科目別合計 marker is looked for.
+    if engine is None:
+        engine = PDF_ENGINE
+    t0 = time.perf_counter()
+    # Check if page contains the target header
+    if not _is_summary_page(page, header_band):
+        if stats is not None:
+            stats.update(layout_seconds=time.perf_counter() - t0, parse_seconds=0.0)
+        return None
+    lines = _page_lines(page, engine)
+    if stats is not None:
+        stats.update(layout_seconds=time.perf_counter() - t0)
+    return lines
+
+def _parse_page(page, stats=None, columns=None, engine=None, header_band=None):
+    # Returns (records, columns). columns is the ColumnModel in effect, passed
+    # on to the next page in case that page has no header row of its own.
+    # stats (optional dict) receives the time spent on layout and on line parsing
+    # records is None for pages outside the 科目別合計 section.
+    lines = _section_lines(page, stats, engine, header_band)
+    if lines is None:
+        return None, columns
+    t1 = time.perf_counter()
+    data, columns, _, unplaced = _parse_lines(lines, columns, page.page_number)
+    if stats is not None:
+        stats.update(parse_seconds=time.perf_counter() - t1, unplaced_lines=unplaced)
+    return data, columns
+
+def _page_chunks(n_pages, n_chunks):
+    # Split range(n_pages) into n_chunks contiguous (start, stop) ranges
+    size, extra = divmod(n_pages, n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        stop = start + size + (1 if i < extra else 0)
+        if stop > start:
+            chunks.append((start, stop))
+        start = stop
+    return chunks
+
+class RecordBuffer:
+    # Column buffers for (pdf_code, pdf_name, pdf_cost) records. Costs are kept
+    # in a typed int64 array instead of one dict per record.
+    def __init__(self):
+        self.codes = []
+        self.names = []
+        self.costs = array('q')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, record):
+        code, name, cost = record
+        self.codes.append(code)
+        self.names.append(name)
+        self.costs.append(cost)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def to_frame(self):
+        import pandas as pd
+        import numpy as np
+        if not self.codes:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'pdf_code': self.codes,
+            'pdf_name': self.names,
+            'pdf_cost': np.frombuffer(self.costs, dtype=np.int64),
+        })
+
+def _page_done(pdf, page, page_index, stats, records, on_page):
+    # Drop the page's cached layout objects once it is parsed
+    page.close()
+    if on_page:
+        # The file name tells the pages of several PDFs apart in the progress and timing report
+        stats.update(file=os.path.basename(pdf.path) if pdf.path else "", page=page_index + 1,
+                     pages=len(pdf.pages), records=len(records or ()))
+        on_page(stats)
+
+def _read_page(pdf, page_index, columns, on_page, engine=None, header_band=None):
+    page = pdf.pages[page_index]
+    stats = {} if on_page else None
+    records, columns = _parse_page(page, stats, columns, engine, header_band)
+    _page_done(pdf, page, page_index, stats, records, on_page)
+    return records, columns
+
+def _read_page_alone(pdf, page_index, on_page, engine=None, header_band=None):
+    # Read a page without the previous page's column model, for the backward
+    # and parallel scans. Returns a page entry (page_index, records, columns,
+    # lines) for _join_pages(): records is None outside the section, columns
+    # the model learned from the page's own header (or None), lines are kept
+    # only when some records were read before that header.
+    page = pdf.pages[page_index]
+    stats = {} if on_page else None
+    lines = _section_lines(page, stats, engine, header_band)
+    records = columns = None
+    carried = False
+    if lines is not None:
+        t1 = time.perf_counter()
+        records, columns, carried, unplaced = _parse_lines(lines, None, page.page_number)
+        if stats is not None:
+            stats.update(parse_seconds=time.perf_counter() - t1, unplaced_lines=unplaced)
+    _page_done(pdf, page, page_index, stats, records, on_page)
+    return page_index, records, columns, lines if carried else None
+
+def _join_pages(entries):
+    # Records of the page entries in page order, as a forward read would give
+    # them: the column model is carried from page to page, and pages that
+    # depend on it are parsed again from their kept lines with the model in effect
+    columns = None
+    for page_index, records, own_columns, lines in sorted(entries, key=lambda entry: entry[0]):
+        if records is None:
+            continue
+        if lines is not None:
+            records, columns, _, _ = _parse_lines(lines, columns, page_index + 1)
+        elif own_columns is not None:
+            columns = own_columns
+        yield from records
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+def _scan_section(pdf, start, stop, on_page=None, cancel=None, engine=None, header_band=None):
+    # The 科目別合計 pages are one contiguous block near the end of the printout.
+    # Walk pages stop-1 .. start backwards, skipping trailing pages and stopping
+    # at the first page before the section, so earlier pages are never read.
+    # Pages are read on their own (_read_page_alone), so the column model is
+    # applied in page order afterwards by _join_pages().
+    # Returns (entries, found_start, seen_section).
+    entries = []
+    seen_section = False
+    for page_index in range(stop - 1, start - 1, -1):
+        if _cancelled(cancel):
+            break
+        entry = _read_page_alone(pdf, page_index, on_page, engine, header_band)
+        if entry[1] is None:
+            if seen_section:
+                return entries, True, True
+            continue
+        seen_section = True
+        entries.append(entry)
+    return entries, False, seen_section
+
+def iter_pdf_records(pdf_path, start=0, stop=None, on_page=None, scan=None, cancel=None, engine=None,
+                     header_band=None):
+    import pdfplumber
+    # Yield (pdf_code, pdf_name, pdf_cost) page by page. Each page's layout
+    # cache is released once it is parsed, so memory does not grow with the
+    # number of pages. on_page(stats) is called after each page read with the
+    # page number, page count, record count and timings. Reading stops at the
+    # next page boundary once the cancel event (threading.Event) is set.
+    if scan is None:
+        scan = SECTION_SCAN
+    with pdfplumber.open(pdf_path) as pdf:
+        n_pages = len(pdf.pages)
+        stop = n_pages if stop is None else min(stop, n_pages)
+        if scan == "all":
+            columns = None
+            for page_index in range(start, stop):
+                if _cancelled(cancel):
+                    return
+                records, columns = _read_page(pdf, page_index, columns, on_page, engine, header_band)
+                yield from records or ()
+            return
+        # Backward scan: records are yielded in page order once the section is read
+        entries, _, _ = _scan_section(pdf, start, stop, on_page, cancel, engine, header_band)
+        yield from _join_pages(entries)
+
+def _extract_page_range(pdf_path, start, stop, page_queue=None, scan=None, engine=None, header_band=None,
+                        cancel=None):
+    # Runs in a worker process: each worker opens the PDF on its own and
+    # returns page entries, joined in page order by the parent (_join_pages),
+    # which carries the column model across the chunk boundaries. Page stats
+    # go to page_queue as each page is read, and the cancel event (both from
+    # a _WorkerLink) is checked before each page.
+    import pdfplumber
+    if scan is None:
+        scan = SECTION_SCAN
+    on_page = page_queue.put if page_queue is not None else None
+    with pdfplumber.open(pdf_path) as pdf:
+        if scan == "all":
+            entries = []
+            for page_index in range(start, stop):
+                if _cancelled(cancel):
+                    break
+                entries.append(_read_page_alone(pdf, page_index, on_page, engine, header_band))
+            return entries, False, False
+        return _scan_section(pdf, start, stop, on_page, cancel, engine, header_band)
+
+class _WorkerLink:
+    # Page stats and the cancel event across processes, for the worker pools.
+    # Workers put their page stats on a managed queue and check a managed
+    # event; the parent forwards the stats to on_page and the caller's cancel
+    # event to the workers each time it polls (pump). Without on_page and
+    # cancel no manager process is started.
+    POLL_SECONDS = 0.1
+
+    def __init__(self, on_page=None, cancel=None):
+        self.on_page = on_page
+        self.cancel = cancel
+        self.manager = None
+        self.queue = None
+        self.event = None
+        if on_page is not None or cancel is not None:
+            self.manager = multiprocessing.Manager()
+            self.queue = self.manager.Queue() if on_page is not None else None
+            self.event = self.manager.Event() if cancel is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.pump()
+        if self.manager is not None:
+            self.manager.shutdown()
+
+    def pump(self):
+        if self.event is not None and _cancelled(self.cancel) and not self.event.is_set():
+            self.event.set()
+        while self.queue is not None:
+            try:
+                stats = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.on_page(stats)
+
+    def wait(self, futures):
+        # Like concurrent.futures.wait(FIRST_COMPLETED), but returns early once
+        # cancelled, and keeps the progress and cancel flowing meanwhile
+        pending = set(futures)
+        while not _cancelled(self.cancel):
+            done, pending = wait(pending, timeout=self.POLL_SECONDS, return_when=FIRST_COMPLETED)
+            self.pump()
+            if done:
+                return done, pending
+        self.pump()
+        return set(), pending
+
+def _resolve_workers(workers, n_pages):
+    if workers is None:
+        workers = PDF_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    # Small files are not worth the process start-up cost
+    if n_pages < PARALLEL_MIN_PAGES:
+        return 1
+    return max(1, min(workers, n_pages))
+
+class ExtractionCancelled(Exception):
+    # Raised by extract_pdf_data() when cancelled; records holds the pages read so far
+    def __init__(self, records):
+        super().__init__("PDF extraction was cancelled")
+        self.records = records
+
+def extract_pdf_data(pdf_path, workers=None, on_page=None, scan=None, cancel=None, engine=None, header_band=None):
+    import pdfplumber
+    # The settings are resolved here and passed down explicitly, also to the
+    # worker processes, so they never fall back to a different environment
+    if scan is None:
+        scan = SECTION_SCAN
+    if engine is None:
+        engine = PDF_ENGINE
+    if header_band is None:
+        header_band = HEADER_BAND
+    with pdfplumber.open(pdf_path) as pdf:
+        n_pages = len(pdf.pages)
+    workers = _resolve_workers(workers, n_pages)
+
+    buffer = RecordBuffer()
+    if workers == 1:
+        buffer.extend(iter_pdf_records(pdf_path, on_page=on_page, scan=scan, cancel=cancel, engine=engine,
+                                       header_band=header_band))
+        if _cancelled(cancel):
+            raise ExtractionCancelled(buffer.to_frame())
+        return buffer.to_frame()
+
+    # Parallel mode: contiguous page ranges per worker, reassembled in page order
+    if scan == "all":
+        chunks = _page_chunks(n_pages, workers)
+    else:
+        # Smaller chunks, queued from the last page backwards, so the pool can
+        # stop once the start of the section has been found
+        chunks = _page_chunks(n_pages, min(n_pages, workers * 4))[::-1]
+    results = []
+    # Page stats stream in while the chunks run; a cancel reaches the workers,
+    # which stop at their next page boundary
+    with _WorkerLink(on_page, cancel) as link, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_extract_page_range, pdf_path, start, stop, link.queue, scan, engine,
+                                   header_band, link.event)
+                   for start, stop in chunks]
+        used = set()
+        seen_section = False
+        for future in futures:
+            while not future.done() and not _cancelled(cancel):
+                link.wait([future])
+            if _cancelled(cancel):
+                break
+            used.add(future)
+            chunk_entries, found_start, chunk_seen = future.result()
+            if seen_section and not chunk_seen:
+                # The section ended at the previous chunk boundary
+                break
+            results.extend(chunk_entries)
+            seen_section = seen_section or chunk_seen
+            if found_start:
+                break
+        for future in futures:
+            future.cancel()
+        # Pass on a cancel that came in after the last poll before waiting for the workers
+        link.pump()
+    if _cancelled(cancel):
+        # Keep what the stopped chunks had read; _join_pages() puts it in page order
+        for future in futures:
+            if future not in used and future.done() and not future.cancelled():
+                results.extend(future.result()[0])
+    buffer.extend(_join_pages(results))
+    if _cancelled(cancel):
+        raise ExtractionCancelled(buffer.to_frame())
+    return buffer.to_frame()
+
+def _app_data_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'Maching')
+
+def _cache_dir():
+    if os.environ.get("MACHING_CACHE_DIR"):
+        return os.environ["MACHING_CACHE_DIR"]
+    return os.path.join(_app_data_dir(), 'pdf_cache')
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_path(pdf_path, engine, scan, header_band):
+    # Every setting that changes the extracted records is part of the key
+    key = f"{_file_sha256(pdf_path)}-v{PARSER_VERSION}-{engine}-{scan}-{header_band:g}"
+    return os.path.join(_cache_dir(), key + '.npz')
+
+def _read_cache(path):
+    import pandas as pd
+    import numpy as np
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            columns = {col: npz[col].tolist() for col in PDF_CACHE_COLUMNS}
+    except (OSError, KeyError, ValueError):
+        return None
+    # Touch the entry so eviction is least-recently-used
+    os.utime(path)
+    df = pd.DataFrame(columns)
+    return df if len(df) else pd.DataFrame()
+
+def _write_cache(path, df):
+    import numpy as np
+    # Store one array per column (compressed), written atomically
+    columns = {
+        'pdf_code': np.asarray(df['pdf_code'].tolist() if len(df) else [], dtype=str),
+        'pdf_name': np.asarray(df['pdf_name'].tolist() if len(df) else [], dtype=str),
+        'pdf_cost': np.asarray(df['pdf_cost'].tolist() if len(df) else [], dtype=np.int64),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **columns)
+    os.replace(tmp_path, path)
+    _evict_cache()
+
+def _evict_cache(max_bytes=None):
+    if max_bytes is None:
+        max_bytes = PDF_CACHE_MAX_BYTES
+    cache_dir = _cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz'):
+            continue
+        stat = os.stat(os.path.join(cache_dir, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    # Drop least recently used entries until the cache fits
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
+
+def clear_pdf_cache():
+    cache_dir = _cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz') or name.endswith('.tmp'):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
+
+def load_pdf_data(pdf_path, workers=None, use_cache=None, on_page=None, cancel=None, engine=None, scan=None,
+                  header_band=None):
+    # extract_pdf_data() with a persistent cache keyed by content hash, parser
+    # version and the extraction settings (engine, section scan, header band)
+    if use_cache is None:
+        use_cache = PDF_CACHE_ENABLED
+    engine = engine or PDF_ENGINE
+    scan = scan or SECTION_SCAN
+    header_band = HEADER_BAND if header_band is None else header_band
+    options = dict(workers=workers, on_page=on_page, cancel=cancel, engine=engine, scan=scan, header_band=header_band)
+    if not use_cache:
+        return extract_pdf_data(pdf_path, **options)
+
+    path = _cache_path(pdf_path, engine, scan, header_band)
+    if os.path.exists(path):
+        df = _read_cache(path)
+        if df is not None:
+            return df
+
+    # A cancelled extraction raises here, so partial results are never cached
+    df = extract_pdf_data(pdf_path, **options)
+    try:
+        _write_cache(path, df)
+    except OSError:
+        # A cache that cannot be written must not break the run
+        pass
+    return df
+
+def _load_pdf_job(pdf_path, use_cache, page_queue, engine, cancel):
+    # Runs in a worker process, one PDF per job. page_queue and cancel come
+    # from the parent's _WorkerLink; a cancelled file returns the pages read so far.
+    on_page = page_queue.put if page_queue is not None else None
+    try:
+        return load_pdf_data(pdf_path, workers=1, use_cache=use_cache, on_page=on_page, cancel=cancel,
+                             engine=engine)
+    except ExtractionCancelled as e:
+        return e.records
+
+def _stack_sources(frames, paths, column):
+    # Concatenate per-file frames with the file name in `column`; empty files add no rows
+    import pandas as pd
+    frames = [df.assign(**{column: os.path.basename(path)}) for df, path in zip(frames, paths) if len(df)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def load_pdf_files(pdf_paths, workers=None, use_cache=None, on_page=None, cancel=None, engine=None):
+    # load_pdf_data() for a set of PDFs (e.g. one printout split by date range
+    # or 営業所). A single file is extracted as before. Several files are
+    # extracted concurrently, one process per file, and stacked in the given
+    # order with the file name in a _pdf_file column.
+    if len(pdf_paths) == 1:
+        return load_pdf_data(pdf_paths[0], workers=workers, use_cache=use_cache, on_page=on_page, cancel=cancel,
+                             engine=engine)
+    if workers is None:
+        workers = PDF_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    # Once cancelled, the running files stop at their next page and are waited
+    # for, so no worker process outlives the call
+    with _WorkerLink(on_page, cancel) as link, \
+            ProcessPoolExecutor(max_workers=max(1, min(workers, len(pdf_paths)))) as executor:
+        futures = {executor.submit(_load_pdf_job, path, use_cache, link.queue, engine, link.event): path
+                   for path in pdf_paths}
+        pending = set(futures)
+        while pending and not _cancelled(cancel):
+            done, pending = link.wait(pending)
+            for future in done:
+                # A file that failed ends the run now, not after the slowest file
+                future.result()
+        for future in pending:
+            future.cancel()
+        link.pump()
+    frames = {futures[future]: future.result() for future in futures if not future.cancelled()}
+    read = [path for path in pdf_paths if path in frames]
+    df = _stack_sources([frames[path] for path in read], read, '_pdf_file')
+    if _cancelled(cancel):
+        raise ExtractionCancelled(df)
+    return df
+
+# MACHING_PROFILE=1 writes a JSON timing report next to the output workbook,
+# MACHING_PROFILE=cprofile additionally writes a cProfile dump (.prof)
+PROFILE_MODE = os.environ.get("MACHING_PROFILE", "")
+
+def _record_count(result):
+    # Rows of a stage's result; stages returning a tuple (e.g. the incremental
+    # ones) have their DataFrame first
+    if isinstance(result, tuple):
+        result = result[0] if result else None
+    return len(result) if hasattr(result, '__len__') else None
+
+class RunProfile:
+    # Wall time, record count and peak memory per stage, plus per-page timings
+    # from extract_pdf_data. Timings are always collected (they are cheap);
+    # memory tracing, cProfile and the report only when enabled.
+    def __init__(self, mode=None):
+        self.mode = PROFILE_MODE if mode is None else mode
+        self.enabled = self.mode not in ("", "0")
+        self.stages = []
+        self.pages = []
+        self._profilers = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def run(self, name, func, *args, **kwargs):
+        # Run one stage. Safe to call from worker threads; each thread gets its
+        # own cProfile profiler and they are merged in write_report().
+        profiler = cProfile.Profile() if self.mode == "cprofile" else None
+        if tracemalloc.is_tracing():
+            # Peak memory is process-wide, so overlapping stages share it
+            tracemalloc.reset_peak()
+        result = None
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            if profiler:
+                profiler.disable()
+            stage = {
+                "stage": name,
+                "thread": threading.current_thread().name,
+                "start_seconds": t0 - self._t0,
+                "seconds": time.perf_counter() - t0,
+                "records": _record_count(result),
+            }
+            if tracemalloc.is_tracing():
+                stage["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            with self._lock:
+                self.stages.append(stage)
+                if profiler:
+                    self._profilers.append(profiler)
+
+    def on_page(self, stats):
+        with self._lock:
+            self.pages.append(dict(stats))
+
+    def write_report(self, output_path):
+        # <output>.timing.json (and <output>.prof) next to the workbook
+        base = os.path.splitext(output_path)[0]
+        report = {
+            "output": output_path,
+            "mode": self.mode,
+            "total_seconds": time.perf_counter() - self._t0,
+            "stages": self.stages,
+            "pages": sorted(self.pages, key=lambda p: (p.get("file", ""), p["page"])),
+        }
+        with open(base + ".timing.json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        if self._profilers:
+            import pstats
+            stats = pstats.Stats(self._profilers[0])
+            for profiler in self._profilers[1:]:
+                stats.add(profiler)
+            stats.dump_stats(base + ".prof")
+
+# Output columns: "コード", "仕入れ先名"（名称は原価データを優先）, "原価一覧の原価", "振替済みの原価"
+OUTPUT_HEADERS = ["コード", "仕入れ先名", "原価一覧の原価", "振替済みの原価"]
+# Rows are listed in this order: Mismatched Cost -> Unmatched Code -> Matched
+STATUS_ORDER = ["mismatched_cost", "unmatched_code", "matched"]
+
+def _to_int(series):
+    import pandas as pd
+    # Non-numeric or missing costs count as 0
+    return pd.to_numeric(series, errors='coerce').fillna(0).astype('int64')
+
+# MACHING_AGGREGATE=1: sum duplicate codes on each side before matching
+RECONCILE_AGGREGATE = os.environ.get("MACHING_AGGREGATE", "0") == "1"
+# Extra output column in aggregate mode, e.g. "CSV×2 PDF×3" for codes that had duplicates
+DUPLICATE_HEADER = "重複"
+# Output columns naming the input files of each row, when several files were read
+# (_csv_file / _pdf_file from read_csv_files() / load_pdf_files())
+SOURCE_HEADERS = {'_csv_file': "CSVファイル", '_pdf_file': "PDFファイル"}
+
+def _join_sources(files):
+    return ", ".join(dict.fromkeys(files))
+
+def _aggregate_by_code(df, code, name, cost, lines, source=None):
+    import pandas as pd
+    # One hashed group-by per side: summed cost, first name and line count per code.
+    # With several files (source) the line count is the largest within one
+    # file: a supplier listed once in each file is not a duplicate.
+    frame = pd.DataFrame({code: df[code], name: df[name], cost: _to_int(df[cost])})
+    aggregations = {name: (name, 'first'), cost: (cost, 'sum'), lines: (cost, 'size')}
+    if source:
+        frame[source] = df[source]
+        frame[lines] = frame.groupby([code, source], sort=False, dropna=False)[cost].transform('size')
+        aggregations[source] = (source, _join_sources)
+        aggregations[lines] = (lines, 'max')
+    return frame.groupby(code, sort=False, dropna=False).agg(**aggregations).reset_index()
+
+def reconcile(df_csv, df_pdf, aggregate=None):
+    import pandas as pd
+    import numpy as np
+    csv_source = '_csv_file' if '_csv_file' in df_csv.columns else None
+    pdf_source = '_pdf_file' if '_pdf_file' in df_pdf.columns else None
+    if aggregate is None:
+        # A supplier usually appears in more than one of several input files
+        aggregate = RECONCILE_AGGREGATE or bool(csv_source or pdf_source)
+    if aggregate:
+        # Duplicated codes would otherwise multiply into N×M rows in the merge
+        df_csv = _aggregate_by_code(df_csv, 'コード', '仕入先名', '合計原価', '_csv_lines', csv_source)
+        df_pdf = _aggregate_by_code(df_pdf, 'pdf_code', 'pdf_name', 'pdf_cost', '_pdf_lines', pdf_source)
+    # Outer join so records that exist on only one side are kept
+    # Requirement: "csvのコードとpdfの仕入先（数字とアルファベット）がマッチするものを合体"
+    # Requirement: "csvのコードとpdfの仕入先（数字とアルファベット）がマッチしないもの...次に記載"
+    merged = pd.merge(df_csv, df_pdf, left_on='コード', right_on='pdf_code', how='outer', indicator=True)
+    
+    result = pd.DataFrame({
+        "コード": merged['コード'].fillna(merged['pdf_code']),
+        "仕入れ先名": merged['仕入先名'].fillna(merged['pdf_name']),
+        "原価一覧の原価": _to_int(merged['合計原価']),
+        "振替済みの原価": _to_int(merged['pdf_cost']),
+    })
+    for source in (csv_source, pdf_source):
+        if source:
+            result[SOURCE_HEADERS[source]] = merged[source].fillna("")
+    if aggregate:
+        csv_lines = merged['_csv_lines'].fillna(0).astype('int64')
+        pdf_lines = merged['_pdf_lines'].fillna(0).astype('int64')
+        csv_part = ("CSV×" + csv_lines.astype(str)).where(csv_lines > 1, "")
+        pdf_part = ("PDF×" + pdf_lines.astype(str)).where(pdf_lines > 1, "")
+        result[DUPLICATE_HEADER] = (csv_part + " " + pdf_part).str.strip()
+    
+    # unmatched_code: code exists in one side only
+    # mismatched_cost: code matches but cost differs
+    status = np.select(
+        [merged['_merge'].to_numpy() != 'both', result["原価一覧の原価"].to_numpy() != result["振替済みの原価"].to_numpy()],
+        ["unmatched_code", "mismatched_cost"],
+        default="matched",
+    )
+    # Which file the row came from: "csv", "pdf" or "both"
+    result["_side"] = merged['_merge'].cat.rename_categories({'left_only': 'csv', 'right_only': 'pdf'})
+    result["_status"] = pd.Categorical(status, categories=STATUS_ORDER, ordered=True)
+    return result.sort_values("_status", kind='stable').reset_index(drop=True)
+
+# Candidate pairs for unmatched codes: a CSV-only and a PDF-only row whose
+# supplier names look alike are often the same supplier under another code.
+# MACHING_SUGGEST=0 turns the 候補ペア sheet off.
+SUGGEST_ENABLED = os.environ.get("MACHING_SUGGEST", "1") != "0"
+SUGGEST_MIN_SCORE = float(os.environ.get("MACHING_SUGGEST_MIN_SCORE", "0.5"))
+SUGGEST_LIMIT = 3
+SUGGEST_SHEET = "候補ペア"
+SUGGEST_HEADERS = ["CSVのコード", "CSVの仕入先名", "CSVの原価", "PDFのコード", "PDFの仕入先名", "PDFの原価", "類似度"]
+# n-grams shared by more names than this are not used to find candidates
+# (they are still counted in the score), so one common gram does not turn
+# the lookup into an all-pairs comparison
+SUGGEST_MAX_POSTINGS = 200
+COMPANY_WORDS = re.compile(r'株式会社|有限会社|合同会社|\(株\)|\(有\)|㈱|㈲|\s')
+HIRAGANA = ''.join(chr(c) for c in range(0x3041, 0x3097))
+HIRAGANA_TO_KATAKANA = str.maketrans(HIRAGANA, ''.join(chr(ord(c) + 0x60) for c in HIRAGANA))
+
+def normalize_name(name):
+    # Full/half width (NFKC), hiragana → katakana, no company-type words or spaces.
+    # A missing name (None, NaN, pd.NA from a blank 仕入先名) normalizes to ''.
+    if not isinstance(name, str):
+        name = ''
+    text = unicodedata.normalize('NFKC', name).translate(HIRAGANA_TO_KATAKANA).upper()
+    return COMPANY_WORDS.sub('', text)
+
+def _name_grams(name, n=2):
+    if len(name) < n:
+        return {name} if name else set()
+    return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+def suggest_pairs(result, min_score=None, limit=SUGGEST_LIMIT):
+    # For each CSV-only unmatched row, up to `limit` PDF-only rows with a
+    # similar name (Dice coefficient of name bigrams >= min_score). PDF-only
+    # names are put in an inverted index (bigram -> rows), so each CSV name is
+    # only compared with the rows it shares a bigram with.
+    import pandas as pd
+    if min_score is None:
+        min_score = SUGGEST_MIN_SCORE
+    csv_only = result[result["_side"] == "csv"]
+    pdf_only = result[result["_side"] == "pdf"]
+
+    pdf_rows = list(pdf_only[["コード", "仕入れ先名", "振替済みの原価"]].itertuples(index=False, name=None))
+    pdf_grams = [_name_grams(normalize_name(name)) for _, name, _ in pdf_rows]
+    index = {}
+    for i, grams in enumerate(pdf_grams):
+        for gram in grams:
+            index.setdefault(gram, []).append(i)
+
+    suggestions = []
+    for code, name, cost in csv_only[["コード", "仕入れ先名", "原価一覧の原価"]].itertuples(index=False, name=None):
+        grams = _name_grams(normalize_name(name))
+        candidates = set()
+        for gram in grams:
+            postings = index.get(gram, ())
+            if len(postings) <= SUGGEST_MAX_POSTINGS:
+                candidates.update(postings)
+        scored = []
+        for i in candidates:
+            score = 2 * len(grams & pdf_grams[i]) / (len(grams) + len(pdf_grams[i]))
+            if score >= min_score:
+                scored.append((score, i))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        for score, i in scored[:limit]:
+            pdf_code, pdf_name, pdf_cost = pdf_rows[i]
+            suggestions.append((code, name, cost, pdf_code, pdf_name, pdf_cost, round(score, 3)))
+
+    df = pd.DataFrame(suggestions, columns=SUGGEST_HEADERS)
+    df = df.astype({"CSVの原価": 'Int64', "PDFの原価": 'Int64'})
+    return df.sort_values("類似度", ascending=False, kind='stable').reset_index(drop=True)
+
+# Incremental re-reconciliation (MACHING_INCREMENTAL=1 or batch --incremental):
+# a state file next to the output keeps each PDF page's fingerprint and
+# records, the CSV rows and the result. A rerun re-reads only pages whose
+# content changed and reclassifies only codes whose rows changed, and the
+# differences to the previous result go to a 前回からの変更 sheet.
+INCREMENTAL_ENABLED = os.environ.get("MACHING_INCREMENTAL", "0") == "1"
+CHANGES_SHEET = "前回からの変更"
+CHANGE_HEADERS = ["コード", "仕入れ先名", "変更内容", "前回の状態", "今回の状態", "前回の原価一覧の原価", "今回の原価一覧の原価",
+                  "前回の振替済みの原価", "今回の振替済みの原価"]
+STATUS_LABELS = {"mismatched_cost": "原価不一致", "unmatched_code": "コード不一致", "matched": "一致"}
+
+def state_path(output_path):
+    return os.path.splitext(output_path)[0] + ".state.json"
+
+def load_state(output_path, aggregate=None, engine=None):
+    # The previous run's state, or None when there is none or it was made
+    # with other settings (then everything is read and classified again)
+    if aggregate is None:
+        aggregate = RECONCILE_AGGREGATE
+    try:
+        with open(state_path(output_path), encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    settings = {'parser_version': PARSER_VERSION, 'engine': engine or PDF_ENGINE, 'header_band': HEADER_BAND,
+                'aggregate': bool(aggregate)}
+    if any(state.get(key) != value for key, value in settings.items()):
+        return None
+    return state
+
+def _json_rows(df):
+    import pandas as pd
+    # Plain Python values (None for missing), so the rows can go into JSON
+    return [[None if pd.isna(value) else value.item() if hasattr(value, 'item') else value for value in row]
+            for row in df.astype(object).itertuples(index=False, name=None)]
+
+def save_state(output_path, pages, df_csv, result, aggregate=None, engine=None):
+    if aggregate is None:
+        aggregate = RECONCILE_AGGREGATE
+    state = {
+        'parser_version': PARSER_VERSION,
+        'engine': engine or PDF_ENGINE,
+        'header_band': HEADER_BAND,
+        'aggregate': bool(aggregate),
+        'pages': pages,
+        'csv': _json_rows(df_csv[[column for column in CSV_COLUMNS if column in df_csv.columns]]),
+        'result': {'columns': list(result.columns), 'rows': _json_rows(result)},
+    }
+    path = state_path(output_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _hash_pdf_object(digest, obj, memo):
+    # Feed a PDF object into digest, following references. Each referenced
+    # object is hashed once per document (memo: objid -> its digest), so fonts
+    # and form XObjects shared by every page are not re-read for each of them.
+    from pdfminer.pdftypes import PDFObjRef, PDFStream
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in memo:
+            memo[obj.objid] = b""  # guards against reference cycles
+            sub = hashlib.sha256()
+            _hash_pdf_object(sub, obj.resolve(), memo)
+            memo[obj.objid] = sub.digest()
+        digest.update(memo[obj.objid])
+    elif isinstance(obj, PDFStream):
+        _hash_pdf_object(digest, obj.attrs, memo)
+        digest.update(obj.get_data())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            digest.update(repr(key).encode())
+            _hash_pdf_object(digest, obj[key], memo)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _hash_pdf_object(digest, item, memo)
+    else:
+        digest.update(repr(obj).encode())
+
+def _page_fingerprint(page, memo=None):
+    # Hash of the page's content streams and resources (fonts, form
+    # XObjects): cheap, no layout analysis needed
+    from pdfminer.pdftypes import resolve1
+    if memo is None:
+        memo = {}
+    digest = hashlib.sha256(repr(page.page_obj.mediabox).encode())
+    for stream in page.page_obj.contents:
+        digest.update(resolve1(stream).get_data())
+    _hash_pdf_object(digest, page.page_obj.resources, memo)
+    return digest.hexdigest()
+
+def extract_pdf_incremental(pdf_path, state=None, on_page=None, cancel=None, engine=None):
+    # extract_pdf_data() that reuses the records of pages whose fingerprint is
+    # unchanged since `state`. Returns (df, pages, reread): pages is the new
+    # per-page state, reread the number of pages that were parsed. A page whose
+    # column header changed also re-reads the next page, which may use it.
+    import pdfplumber
+    previous = state['pages'] if state else []
+    pages = []
+    reread = 0
+    buffer = RecordBuffer()
+    columns = None
+    columns_changed = False
+    memo = {}
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_index, page in enumerate(pdf.pages):
+            if _cancelled(cancel):
+                raise ExtractionCancelled(buffer.to_frame())
+            fingerprint = _page_fingerprint(page, memo)
+            old = previous[page_index] if page_index < len(previous) else None
+            if old is not None and old['fingerprint'] == fingerprint and not columns_changed:
+                entry = old
+                columns = ColumnModel([tuple(block) for block in old['columns']]) if old['columns'] else None
+            else:
+                records, columns = _read_page(pdf, page_index, columns, on_page, engine)
+                reread += 1
+                entry = {
+                    'fingerprint': fingerprint,
+                    'records': None if records is None else [list(record) for record in records],
+                    'columns': [list(block) for block in columns.blocks] if columns else None,
+                }
+                columns_changed = old is None or old['columns'] != entry['columns']
+            pages.append(entry)
+            buffer.extend(entry['records'] or ())
+    return buffer.to_frame(), pages, reread
+
+def _rows_by_code(rows):
+    by_code = {}
+    for row in rows:
+        by_code.setdefault(row[0], []).append(tuple(row))
+    return by_code
+
+def _changed_codes(old_rows, new_rows):
+    old, new = _rows_by_code(old_rows), _rows_by_code(new_rows)
+    return {code for code in old.keys() | new.keys() if old.get(code) != new.get(code)}
+
+def _restore_result(saved):
+    import pandas as pd
+    result = pd.DataFrame(saved['rows'], columns=saved['columns'])
+    result = result.astype({"原価一覧の原価": 'int64', "振替済みの原価": 'int64'})
+    result["_side"] = pd.Categorical(result["_side"], categories=['csv', 'pdf', 'both'])
+    result["_status"] = pd.Categorical(result["_status"], categories=STATUS_ORDER, ordered=True)
+    return result
+
+def reconcile_incremental(df_csv, df_pdf, state, aggregate=None):
+    # reconcile() for the codes whose CSV rows or PDF records differ from
+    # `state`; every other code keeps its previous result rows. Returns
+    # (result, previous_result); previous_result is None without a state.
+    import pandas as pd
+    if state is None:
+        return reconcile(df_csv, df_pdf, aggregate=aggregate), None
+    previous = _restore_result(state['result'])
+    old_pdf = [record for page in state['pages'] for record in page['records'] or ()]
+    csv_columns = [column for column in CSV_COLUMNS if column in df_csv.columns]
+    affected = (_changed_codes(state['csv'], _json_rows(df_csv[csv_columns]))
+                | _changed_codes(old_pdf, _json_rows(df_pdf[PDF_CACHE_COLUMNS]) if len(df_pdf) else []))
+    if not affected:
+        return previous, previous
+    kept = previous[~previous["コード"].isin(affected)]
+    csv_part = df_csv[df_csv['コード'].isin(affected)]
+    pdf_part = df_pdf[df_pdf['pdf_code'].isin(affected)] if len(df_pdf) else df_pdf
+    parts = [kept]
+    if len(csv_part) or len(pdf_part):
+        if not len(pdf_part):
+            pdf_part = pd.DataFrame({column: pd.Series(dtype=object) for column in PDF_CACHE_COLUMNS})
+        parts.append(reconcile(csv_part, pdf_part, aggregate=aggregate)[previous.columns])
+    # Same order as a full reconcile(): by code (the merge key), then by status
+    result = pd.concat(parts, ignore_index=True)
+    result["_side"] = pd.Categorical(result["_side"].astype(str), categories=['csv', 'pdf', 'both'])
+    result["_status"] = pd.Categorical(result["_status"].astype(str), categories=STATUS_ORDER, ordered=True)
+    result = result.sort_values("コード", kind='stable').sort_values("_status", kind='stable')
+    return result.reset_index(drop=True), previous
+
+def diff_results(previous, current):
+    # One row per code whose status or costs differ between two results
+    import pandas as pd
+    import numpy as np
+
+    def per_code(result):
+        grouped = result.groupby("コード", sort=False, observed=True)
+        return pd.DataFrame({
+            "仕入れ先名": grouped["仕入れ先名"].first(),
+            "状態": grouped["_status"].min().astype(str),
+            "原価一覧の原価": grouped["原価一覧の原価"].sum(),
+            "振替済みの原価": grouped["振替済みの原価"].sum(),
+        })
+
+    merged = per_code(previous).join(per_code(current), how='outer', lsuffix='_old', rsuffix='_new')
+    old_missing = merged["状態_old"].isna()
+    new_missing = merged["状態_new"].isna()
+    status_changed = merged["状態_old"] != merged["状態_new"]
+    cost_changed = ((merged["原価一覧の原価_old"] != merged["原価一覧の原価_new"])
+                    | (merged["振替済みの原価_old"] != merged["振替済みの原価_new"]))
+    change = np.select([old_missing, new_missing, status_changed, cost_changed],
+                       ["新規", "削除", "状態変更", "原価変更"], default="")
+    changes = pd.DataFrame({
+        "コード": merged.index,
+        "仕入れ先名": merged["仕入れ先名_new"].fillna(merged["仕入れ先名_old"]).to_numpy(),
+        "変更内容": change,
+        "前回の状態": merged["状態_old"].map(STATUS_LABELS).to_numpy(),
+        "今回の状態": merged["状態_new"].map(STATUS_LABELS).to_numpy(),
+        "前回の原価一覧の原価": merged["原価一覧の原価_old"].astype('Int64').to_numpy(),
+        "今回の原価一覧の原価": merged["原価一覧の原価_new"].astype('Int64').to_numpy(),
+        "前回の振替済みの原価": merged["振替済みの原価_old"].astype('Int64').to_numpy(),
+        "今回の振替済みの原価": merged["振替済みの原価_new"].astype('Int64').to_numpy(),
+    }, columns=CHANGE_HEADERS)
+    changes = changes[changes["変更内容"] != ""]
+    return changes.sort_values(["変更内容", "コード"], kind='stable').reset_index(drop=True)
+
+# Row highlight per status: Light Yellow (cost mismatch), Light Red (code only on one side)
+STATUS_FILLS = {
+    "mismatched_cost": "FFFFE0",
+    "unmatched_code": "FFCCCC",
+}
+
+def _status_styles(wb):
+    from openpyxl.styles import NamedStyle, PatternFill
+    # One shared named style per highlighted status instead of a fill object per cell
+    styles = {}
+    for status, color in STATUS_FILLS.items():
+        style = NamedStyle(name=f"maching_{status}")
+        style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        wb.add_named_style(style)
+        styles[status] = style.name
+    return styles
+
+def _append_frame(wb, title, df):
+    import pandas as pd
+    ws = wb.create_sheet(title)
+    ws.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
+        ws.append([None if pd.isna(value) else value for value in row])
+
+def write_workbook(result, output_path, suggestions=None, changes=None, extra_sheets=None):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    # Write-only workbook: rows are streamed to disk instead of kept as cells in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("マッチング結果")
+    styles = _status_styles(wb)
+    
+    # OUTPUT_HEADERS plus any extra columns reconcile() added; columns starting
+    # with "_" (_side, _status) are internal and not written
+    visible = [column for column in result.columns if not column.startswith("_")]
+    ws.append(visible)
+    for row_values, status in zip(result[visible].itertuples(index=False, name=None), result["_status"]):
+        style = styles.get(status)
+        if style is None:
+            ws.append(row_values)
+            continue
+        cells = []
+        for value in row_values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            cells.append(cell)
+        ws.append(cells)
+
+    # Candidate pairs from suggest_pairs(), when there are any
+    if suggestions is not None and len(suggestions):
+        _append_frame(wb, SUGGEST_SHEET, suggestions)
+    # Differences to the previous run (incremental mode), written even when empty
+    if changes is not None:
+        _append_frame(wb, CHANGES_SHEET, changes)
+    # Any other {title: DataFrame} sheets, in order
+    for title, df in (extra_sheets or {}).items():
+        _append_frame(wb, title, df)
+    
+    wb.save(output_path)
+
+# Reconciliation history: every run's classified rows go into a local SQLite
+# database, so results can be compared across months without the workbooks.
+# MACHING_HISTORY=0 disables it, MACHING_HISTORY_DB overrides its location.
+HISTORY_ENABLED = os.environ.get("MACHING_HISTORY", "1") != "0"
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_date    TEXT NOT NULL,      -- yyyymmdd of the CSV file name
+    code        TEXT NOT NULL,
+    name        TEXT,
+    csv_cost    INTEGER,
+    pdf_cost    INTEGER,
+    status      TEXT NOT NULL,
+    csv_path    TEXT,
+    pdf_path    TEXT,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_code_date ON results (code, run_date);
+CREATE INDEX IF NOT EXISTS results_status_date ON results (status, run_date);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_date, csv_path, pdf_path);
+"""
+HISTORY_COLUMNS = ['run_date', 'code', 'name', 'csv_cost', 'pdf_cost', 'status', 'csv_path', 'pdf_path',
+                   'recorded_at']
+
+def _history_path():
+    return os.environ.get("MACHING_HISTORY_DB") or os.path.join(_app_data_dir(), 'history.sqlite3')
+
+def open_history(path=None):
+    path = path or _history_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Batch jobs write from several processes; wait for the lock instead of failing
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(HISTORY_SCHEMA)
+    return conn
+
+def record_history(result, csv_path, pdf_path, run_date=None, path=None):
+    # Store the rows of reconcile() under run_date (default: the CSV's date).
+    # A run is keyed by (run_date, csv_path, pdf_path): rerunning the same files
+    # replaces their rows, so reruns do not double count, while other pairs
+    # with the same date (e.g. another 営業所) are kept. Rows without a コード
+    # (e.g. a blank-code 合計 line) cannot be looked up by code and are skipped,
+    # instead of failing the NOT NULL constraint and losing the whole run.
+    import pandas as pd
+    from datetime import datetime
+    run_date = run_date or file_date(csv_path) or datetime.now().strftime("%Y%m%d")
+    recorded_at = datetime.now().isoformat(timespec='seconds')
+    columns = [result["コード"], result["仕入れ先名"], result["原価一覧の原価"], result["振替済みの原価"],
+               result["_status"].astype(str)]
+    rows = [
+        (run_date, code, None if pd.isna(name) else name, None if pd.isna(csv_cost) else int(csv_cost),
+         None if pd.isna(pdf_cost) else int(pdf_cost), status, csv_path, pdf_path, recorded_at)
+        for code, name, csv_cost, pdf_cost, status in zip(*columns)
+        if not pd.isna(code) and code != ""
+    ]
+    with closing(open_history(path)) as conn, conn:
+        conn.execute("DELETE FROM results WHERE run_date = ? AND csv_path = ? AND pdf_path = ?",
+                     (run_date, csv_path, pdf_path))
+        conn.executemany(f"INSERT INTO results ({', '.join(HISTORY_COLUMNS)}) VALUES "
+                         f"({', '.join('?' * len(HISTORY_COLUMNS))})", rows)
+    return len(rows)
+
+def _save_history(result, csv_paths, pdf_paths):
+    # The workbook is the primary output: a history that cannot be written only gets logged.
+    # Several inputs are stored under the date of the latest CSV.
+    try:
+        record_history(result, "; ".join(csv_paths), "; ".join(pdf_paths),
+                       run_date=file_date(latest_input(csv_paths)))
+    except (sqlite3.Error, OSError) as e:
+        _log(f"history not recorded: {e}")
+
+def _month_start(yyyymm, months_back):
+    year, month = divmod(int(yyyymm[:4]) * 12 + int(yyyymm[4:6]) - 1 - months_back, 12)
+    return f"{year:04d}{month + 1:02d}01"
+
+def query_history(status, months=6, min_months=3, until=None, path=None):
+    # Codes with `status` in at least min_months of the `months` months up to
+    # `until` (yyyymm, default: this month). Served by the (status, run_date) index.
+    import pandas as pd
+    from datetime import datetime
+    until = until or datetime.now().strftime("%Y%m")
+    query = """
+        SELECT code, MAX(name) AS name, COUNT(DISTINCT substr(run_date, 1, 6)) AS months,
+               COUNT(*) AS runs, MIN(run_date) AS first_date, MAX(run_date) AS last_date
+        FROM results
+        WHERE status = ? AND run_date >= ? AND run_date < ?
+        GROUP BY code
+        HAVING months >= ?
+        ORDER BY months DESC, code
+    """
+    params = (status, _month_start(until, months - 1), _month_start(until, -1), min_months)
+    with closing(open_history(path)) as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def code_history(code, path=None):
+    # Every stored row for one code, oldest first (served by the (code, run_date) index)
+    import pandas as pd
+    with closing(open_history(path)) as conn:
+        df = pd.read_sql_query(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM results WHERE code = ? "
+                               f"ORDER BY run_date", conn, params=(code,))
+    return df.astype({'csv_cost': 'Int64', 'pdf_cost': 'Int64'})
+
+def export_history(output_path, since=None, until=None, code=None, status=None, path=None):
+    # Write the stored rows (optionally filtered) to CSV (utf-8 with BOM, for Excel)
+    import pandas as pd
+    conditions, params = [], []
+    for column, operator, value in (('run_date', '>=', since), ('run_date', '<=', until),
+                                    ('code', '=', code), ('status', '=', status)):
+        if value:
+            conditions.append(f"{column} {operator} ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(open_history(path)) as conn:
+        df = pd.read_sql_query(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM results {where} "
+                               f"ORDER BY run_date, code", conn, params=params)
+    df = df.astype({'csv_cost': 'Int64', 'pdf_cost': 'Int64'})
+    df.to_csv(output_path, index=False, encoding='utf-8-sig')
+    return len(df)
+
+# Where main() saves the result workbook
+DESKTOP_DIR = os.path.join(os.path.expanduser('~'), 'Desktop')
+NO_PDF_DATA_MESSAGE = "PDFからデータを抽出できませんでした。「科目別合計」のページが見つからないか、形式が異なります。"
+# Appended to the output name when the PDF extraction was cancelled part-way
+PARTIAL_SUFFIX = "_途中"
+
+# 未払合計 CSV: only these columns are used (コード is required)
+CSV_ENCODING = 'cp932'
+CSV_COLUMNS = {
+    'コード': str,
+    '仕入先名': str,
+    '合計原価': 'Int64',
+}
+
+def _read_csv_columns(csv_path, raw, cost_dtype):
+    import pandas as pd
+    usecols = list(raw.values())
+    dtype = {raw[name]: (cost_dtype if name == '合計原価' else dtype) for name, dtype in CSV_COLUMNS.items() if name in raw}
+    # Only empty cells are missing: codes such as "NA" or "NULL" stay as text.
+    # The C engine applies dtype while parsing, so codes like "0123" keep their
+    # leading zeros (the pyarrow engine infers integers first and casts after).
+    options = dict(encoding=CSV_ENCODING, usecols=usecols, dtype=dtype, keep_default_na=False, na_values=[''])
+    return pd.read_csv(csv_path, engine='c', **options)
+
+def read_csv_data(csv_path):
+    import pandas as pd
+    # Assuming CSV has headers. Based on `head` output: コード,仕入先名,合計原価,...
+    # Read the header first: names may carry whitespace (stripped), and only the
+    # needed columns are parsed, with pinned dtypes.
+    header = pd.read_csv(csv_path, encoding=CSV_ENCODING, nrows=0).columns
+    raw = {}
+    for column in header:
+        raw.setdefault(column.strip(), column)
+    
+    # Check required columns
+    if 'コード' not in raw:
+        # Fallback or Error
+        cols = ", ".join(header.str.strip())
+        raise ValueError(f"CSVファイルに「コード」列が見つかりません。\n実際の列名: {cols}")
+    raw = {name: raw[name] for name in CSV_COLUMNS if name in raw}
+    
+    try:
+        df_csv = _read_csv_columns(csv_path, raw, CSV_COLUMNS['合計原価'])
+    except ValueError:
+        # A non-numeric cost cell: read costs as text, reconcile() counts those as 0
+        df_csv = _read_csv_columns(csv_path, raw, str)
+    # Cleanup Column Names (Strip whitespace)
+    df_csv.columns = df_csv.columns.str.strip()
+    return df_csv
+
+def read_csv_files(csv_paths):
+    # read_csv_data() for a set of CSVs. Several files are read in threads (the
+    # C parser releases the GIL) and stacked with the file name in a _csv_file column.
+    if len(csv_paths) == 1:
+        return read_csv_data(csv_paths[0])
+    workers = min(len(csv_paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="csv") as executor:
+        frames = list(executor.map(read_csv_data, csv_paths))
+    return _stack_sources(frames, csv_paths, '_csv_file')
+
+def file_date(path):
+    # yyyymmdd from the file name, or None
+    match_date = re.search(r'\d{8}', os.path.basename(path))
+    return match_date.group(0) if match_date else None
+
+def latest_input(paths):
+    # The file with the latest yyyymmdd in its name (the last one if none has a date);
+    # names the output and dates the history when several CSVs are reconciled together
+    return max(reversed(paths), key=lambda path: file_date(path) or "")
+
+def output_filename(csv_path):
+    # yyyymmdd is dependent on selected CSV.
+    date_str = file_date(csv_path)
+    if date_str is None:
+        from datetime import datetime
+        date_str = datetime.now().strftime("%Y%m%d")
+    return f"{date_str}マッチング済み.xlsx"
+
+def partial_output_path(output_path):
+    # yyyymmddマッチング済み_途中.xlsx, for a result from a cancelled PDF extraction
+    base, ext = os.path.splitext(output_path)
+    return f"{base}{PARTIAL_SUFFIX}{ext}"
+
+def finish_run(profile, df_csv, df_pdf, csv_paths, pdf_paths, output_path, state=None, pages=None,
+               aggregate=None, engine=None, history=None, partial=False):
+    # Everything after the inputs are read, shared by main() and reconcile_files():
+    # reconcile, suggest, write the workbook, then the state, history and profile.
+    # pages (from extract_pdf_incremental) selects the incremental path against
+    # state. A partial result (cancelled extraction) gets no suggestions and is
+    # kept out of the state and history, where it would record false unmatched codes.
+    changes = None
+    if pages is not None and not partial:
+        result, previous = profile.run("reconcile", reconcile_incremental, df_csv, df_pdf, state, aggregate=aggregate)
+        if previous is not None:
+            changes = diff_results(previous, result)
+    else:
+        result = profile.run("reconcile", reconcile, df_csv, df_pdf, aggregate=aggregate)
+    suggestions = None
+    if SUGGEST_ENABLED and not partial:
+        suggestions = profile.run("suggest_pairs", suggest_pairs, result)
+    profile.run("write_workbook", write_workbook, result, output_path, suggestions, changes)
+    if pages is not None and not partial:
+        save_state(output_path, pages, df_csv, result, aggregate, engine)
+    if (HISTORY_ENABLED if history is None else history) and not partial:
+        _save_history(result, csv_paths, pdf_paths)
+    if profile.enabled:
+        profile.write_report(output_path)
+    return result
+
+def reconcile_files(csv_path, pdf_path, output_path, workers=None, use_cache=None, profile_mode=None,
+                    aggregate=None, engine=None, history=None, incremental=None):
+    # Non-GUI version of main(): read, extract, reconcile and write one pair.
+    # csv_path and pdf_path may also be lists of files, reconciled together.
+    # incremental (one pair only) reuses the state left next to output_path by the previous run.
+    csv_paths = [csv_path] if isinstance(csv_path, str) else list(csv_path)
+    pdf_paths = [pdf_path] if isinstance(pdf_path, str) else list(pdf_path)
+    if incremental is None:
+        incremental = INCREMENTAL_ENABLED
+    incremental = incremental and len(csv_paths) == len(pdf_paths) == 1
+    state = load_state(output_path, aggregate, engine) if incremental else None
+    profile = RunProfile(profile_mode)
+    df_csv = profile.run("read_csv", read_csv_files, csv_paths)
+    pages = None
+    if incremental:
+        df_pdf, pages, reread = profile.run("extract_pdf", extract_pdf_incremental, pdf_paths[0], state,
+                                            on_page=profile.on_page, engine=engine)
+        _log(f"incremental: {reread} of {len(pages)} pages read")
+    else:
+        df_pdf = profile.run("extract_pdf", load_pdf_files, pdf_paths, workers=workers, use_cache=use_cache,
+                             on_page=profile.on_page, engine=engine)
+    if df_pdf.empty:
+        raise ValueError(NO_PDF_DATA_MESSAGE)
+    result = finish_run(profile, df_csv, df_pdf, csv_paths, pdf_paths, output_path, state=state, pages=pages,
+                        aggregate=aggregate, engine=engine, history=history)
+    counts = result["_status"].value_counts()
+    return {status: int(counts.get(status, 0)) for status in STATUS_ORDER}
+
+# Reservation-level sales export (予約番号, 売上金額, 原価, 斡旋手数料, 利益, …).
+# It is far larger than the 未払合計 summary, so it is streamed in chunks:
+# each chunk is checked (利益 = 売上金額 − 原価 − 斡旋手数料) and reduced to
+# 原価 totals per code before the next one is read.
+SALES_AMOUNT_COLUMNS = ['売上金額', '原価', '斡旋手数料', '利益']
+# MACHING_SALES_CODE: the column 原価 is totalled by (e.g. 代理店コード or 広告媒体コード)
+SALES_CODE_COLUMN = os.environ.get("MACHING_SALES_CODE", "代理店コード")
+SALES_CHUNKSIZE = int(os.environ.get("MACHING_SALES_CHUNKSIZE", "200000"))
+# Rows with a wrong 利益 kept for the report (all of them are counted)
+SALES_ERROR_LIMIT = 10000
+SALES_COST_HEADER = "売上データの原価"
+SALES_COUNT_HEADER = "予約件数"
+PROFIT_SHEET = "利益の不一致"
+
+def _sniff_encoding(path):
+    # The export is UTF-8 (with or without BOM) or cp932 like the 未払合計 CSV
+    import codecs
+    with open(path, 'rb') as f:
+        head = f.read(64 * 1024)
+    try:
+        # Incremental decoder: a character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return CSV_ENCODING
+
+def _sales_name_column(header, code_column):
+    # 代理店コード -> 代理店名, 広告媒体コード -> 広告媒体名称
+    for candidate in (code_column.replace('コード', '名'), code_column.replace('コード', '名称')):
+        if candidate != code_column and candidate in header:
+            return candidate
+    return None
+
+def aggregate_sales(sales_path, code_column=None, chunksize=None):
+    # Stream the export and return (totals, errors, rows): totals has one row
+    # per code (コード, 仕入先名, 合計原価, 予約件数), errors the first
+    # SALES_ERROR_LIMIT rows whose 利益 does not add up (with their count in
+    # errors.attrs['count']), rows the number of rows read. The export lists the
+    # rows of one reservation together, so 予約件数 counts the runs of equal
+    # (code, 予約番号); only the last one is carried over into the next chunk.
+    import pandas as pd
+    import numpy as np
+    code_column = code_column or SALES_CODE_COLUMN
+    chunksize = chunksize or SALES_CHUNKSIZE
+    encoding = _sniff_encoding(sales_path)
+    header = pd.read_csv(sales_path, encoding=encoding, nrows=0).columns.str.strip()
+    missing = [column for column in ['予約番号', code_column] + SALES_AMOUNT_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"売上データに必要な列がありません: {', '.join(missing)}\n実際の列名: {', '.join(header)}")
+    name_column = _sales_name_column(header, code_column)
+    columns = ['予約番号', code_column] + ([name_column] if name_column else []) + SALES_AMOUNT_COLUMNS
+
+    totals = None
+    last_row = ('', '')
+    errors = []
+    n_errors = 0
+    rows = 0
+    # Everything is read as text; amounts are converted per chunk so one bad cell does not stop the run
+    chunks = pd.read_csv(sales_path, encoding=encoding, usecols=lambda column: column.strip() in columns, dtype=str,
+                         keep_default_na=False, na_values=[''], chunksize=chunksize, engine='c')
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.strip()
+        rows += len(chunk)
+        amounts = {column: pd.to_numeric(chunk[column].str.replace(',', ''), errors='coerce').astype('Int64')
+                   for column in SALES_AMOUNT_COLUMNS}
+        expected = amounts['売上金額'] - amounts['原価'] - amounts['斡旋手数料']
+        bad = (amounts['利益'] != expected).fillna(True).to_numpy(dtype=bool)
+        if bad.any():
+            n_errors += int(bad.sum())
+            if sum(len(e) for e in errors) < SALES_ERROR_LIMIT:
+                error_rows = chunk.loc[bad, ['予約番号', code_column]].copy()
+                for column in SALES_AMOUNT_COLUMNS:
+                    error_rows[column] = amounts[column][bad]
+                error_rows['計算上の利益'] = expected[bad]
+                error_rows['差額'] = amounts['利益'][bad] - expected[bad]
+                errors.append(error_rows)
+
+        # A row starts a reservation when its (code, 予約番号) differs from the
+        # row before it, which for the first row is the last row of the previous chunk
+        codes = chunk[code_column].fillna('').to_numpy(dtype=object)
+        numbers = chunk['予約番号'].fillna('').to_numpy(dtype=object)
+        if len(chunk):
+            previous_codes = np.concatenate([[last_row[0]], codes[:-1]])
+            previous_numbers = np.concatenate([[last_row[1]], numbers[:-1]])
+            last_row = (codes[-1], numbers[-1])
+        else:
+            previous_codes = previous_numbers = codes
+        starts = ((codes != previous_codes) | (numbers != previous_numbers)) & (numbers != '')
+
+        part = pd.DataFrame({
+            'コード': chunk[code_column],
+            '仕入先名': chunk[name_column] if name_column else pd.Series(pd.NA, index=chunk.index, dtype=object),
+            '合計原価': amounts['原価'].fillna(0),
+            '予約件数': starts.astype('int64'),
+        })
+        part = part.groupby('コード', sort=False, dropna=False).agg(
+            仕入先名=('仕入先名', 'first'), 合計原価=('合計原価', 'sum'), 予約件数=('予約件数', 'sum'))
+        # Fold the chunk into the running totals: memory grows with the number of codes only
+        if totals is not None:
+            part = pd.concat([totals, part]).groupby(level=0, sort=False, dropna=False).agg(
+                仕入先名=('仕入先名', 'first'), 合計原価=('合計原価', 'sum'), 予約件数=('予約件数', 'sum'))
+        totals = part
+
+    if totals is None:
+        totals = pd.DataFrame(columns=['仕入先名', '合計原価', '予約件数'])
+    totals = totals.rename_axis('コード').reset_index()
+    error_columns = ['予約番号', code_column] + SALES_AMOUNT_COLUMNS + ['計算上の利益', '差額']
+    errors = pd.concat(errors, ignore_index=True).head(SALES_ERROR_LIMIT) if errors else pd.DataFrame(columns=error_columns)
+    errors.attrs['count'] = n_errors
+    return totals, errors, rows
+
+def reconcile_sales(sales_path, pdf_paths, output_path, code_column=None, chunksize=None, workers=None,
+                    use_cache=None, engine=None):
+    # Cross-check the 原価 totals per code from the sales export against the
+    # pdf_cost totals of the PDF(s), with the same classification and workbook
+    # as the 未払合計 reconciliation, plus a sheet of rows with a wrong 利益.
+    profile = RunProfile()
+    # Several PDFs are summed per code like the 未払合計 reconciliation (aggregate=True below)
+    totals, errors, rows = profile.run("read_sales", aggregate_sales, sales_path, code_column, chunksize)
+    df_pdf = profile.run("extract_pdf", load_pdf_files, list(pdf_paths), workers=workers, use_cache=use_cache,
+                         engine=engine)
+    if df_pdf.empty:
+        raise ValueError(NO_PDF_DATA_MESSAGE)
+    result = profile.run("reconcile", reconcile, totals[list(CSV_COLUMNS)], df_pdf, aggregate=True)
+    counts_by_code = dict(zip(totals['コード'], totals['予約件数']))
+    result.insert(result.columns.get_loc("振替済みの原価") + 1, SALES_COUNT_HEADER,
+                  result["コード"].map(counts_by_code).fillna(0).astype('int64'))
+    result = result.rename(columns={"原価一覧の原価": SALES_COST_HEADER})
+    profile.run("write_workbook", write_workbook, result, output_path,
+                extra_sheets={PROFIT_SHEET: errors} if len(errors) else None)
+    if profile.enabled:
+        profile.write_report(output_path)
+    counts = result["_status"].value_counts()
+    summary = {'rows': rows, 'profit_errors': errors.attrs['count']}
+    summary.update({status: int(counts.get(status, 0)) for status in STATUS_ORDER})
+    return summary
 
 def main():
-    # 1. Select Cost Data File (CSV)
-    csv_path = select_file("1. 原価データファイルを選択してください (CSV)", [("CSV Files", "*.csv")])
-    if not csv_path:
+    _warm_up()
+    
+    # 1. Select Cost Data File(s) (CSV); several files are reconciled together
+    csv_paths = select_file("1. 原価データファイルを選択してください (CSV、複数選択可)", [("CSV Files", "*.csv")],
+                            multiple=True)
+    if not csv_paths:
         messagebox.showinfo("キャンセル", "ファイル選択がキャンセルされました。")
         return
 
-    # 2. Select Transferred Data File (PDF)
-    pdf_path = select_file("2. 振替済みデータファイルを選択してください (PDF)", [("PDF Files", "*.pdf")])
-    if not pdf_path:
+    # Read the CSV in the background while the PDF is being chosen
+    profile = RunProfile()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="load")
+    csv_future = executor.submit(profile.run, "read_csv", read_csv_files, csv_paths)
+
+    # 2. Select Transferred Data File(s) (PDF)
+    pdf_paths = select_file("2. 振替済みデータファイルを選択してください (PDF、複数選択可)", [("PDF Files", "*.pdf")],
+                            multiple=True)
+    if not pdf_paths:
+        executor.shutdown(wait=False, cancel_futures=True)
         messagebox.showinfo("キャンセル", "ファイル選択がキャンセルされました。")
         return
 
+    # Start PDF extraction as soon as its path is known, with a progress window
+    window = ProgressWindow()
+    
+    def on_page(stats):
+        profile.on_page(stats)
+        window.on_page(stats)
+    
+    # Save File (to Desktop)
+    output_path = os.path.join(DESKTOP_DIR, output_filename(latest_input(csv_paths)))
+    # Incremental mode (one CSV and one PDF): only pages changed since the last run are read
+    incremental = INCREMENTAL_ENABLED and len(csv_paths) == len(pdf_paths) == 1
+    state = load_state(output_path) if incremental else None
+    if incremental:
+        pdf_future = executor.submit(profile.run, "extract_pdf", extract_pdf_incremental, pdf_paths[0], state,
+                                     on_page=on_page, cancel=window.cancel)
+    else:
+        pdf_future = executor.submit(profile.run, "extract_pdf", load_pdf_files, pdf_paths, on_page=on_page,
+                                     cancel=window.cancel)
+    executor.shutdown(wait=False)
+    window.wait(pdf_future, csv_future)
+
     try:
-        # Read CSV
-        # Assuming CSV has headers. Based on `head` output: コード,仕入先名,合計原価,...
-        df_csv = pd.read_csv(csv_path, encoding='cp932')
-        # Cleanup Column Names (Strip whitespace)
-        df_csv.columns = df_csv.columns.str.strip()
-        
-        # Check required columns
-        if 'コード' not in df_csv.columns:
-            # Fallback or Error
-            cols = ", ".join(df_csv.columns)
-            raise ValueError(f"CSVファイルに「コード」列が見つかりません。\n実際の列名: {cols}")
-        
-        # Extract PDF Data
-        df_pdf = extract_pdf_data(pdf_path)
+        # Wait for both inputs. Errors raised in the background (e.g. missing
+        # 「コード」 column) come out of result() and are reported below.
+        df_csv = csv_future.result()
+        pages = None
+        partial = False
+        try:
+            if incremental:
+                df_pdf, pages, _ = pdf_future.result()
+            else:
+                df_pdf = pdf_future.result()
+        except ExtractionCancelled as e:
+            # Stopped at a page boundary: offer to continue with what was read
+            df_pdf = e.records
+            message = (f"PDFの読み込みをキャンセルしました。\n"
+                       f"読込済み: {window.pages_read} ページ / 抽出件数: {len(df_pdf)} 件\n\n"
+                       f"途中までの結果で照合しますか？")
+            if not messagebox.askyesno("キャンセル", message):
+                return
+            # Saved next to, never over, the complete result of this date
+            partial = True
+            output_path = partial_output_path(output_path)
         
         if df_pdf.empty:
-            messagebox.showwarning("警告", "PDFからデータを抽出できませんでした。「科目別合計」のページが見つからないか、形式が異なります。")
+            messagebox.showwarning("警告", NO_PDF_DATA_MESSAGE)
             return
 
-        # Merge Data
-        # Left join on Code to keep all CSV records, and Outer join to find unmatched PDF records?
-        # Requirement: "csvのコードとpdfの仕入先（数字とアルファベット）がマッチするものを合体"
-        # Requirement: "csvのコードとpdfの仕入先（数字とアルファベット）がマッチしないもの...次に記載"
-        
-        # Let's use an outer join to get all records from both
-        merged = pd.merge(df_csv, df_pdf, left_on='コード', right_on='pdf_code', how='outer')
-        
-        # Prepare Output Columns
-        # "コード", "仕入れ先名"（名称は原価データを優先）, "原価一覧の原価", "振替済みの原価"
-        
-        output_data = []
-        
-        # Separate into categories for sorting/ordering
-        mismatched_cost = []
-        unmatched_code = []
-        matched = []
-        
-        for index, row in merged.iterrows():
-            code = row['コード'] if pd.notna(row['コード']) else row['pdf_code']
-            name = row['仕入先名'] if pd.notna(row['仕入先名']) else row['pdf_name']
-            csv_cost = row['合計原価'] if pd.notna(row['合計原価']) else 0
-            pdf_cost = row['pdf_cost'] if pd.notna(row['pdf_cost']) else 0
-            
-            # Ensure costs are integers for comparison
-            try:
-                csv_cost = int(csv_cost)
-            except:
-                csv_cost = 0
-            
-            try:
-                pdf_cost = int(pdf_cost)
-            except:
-                pdf_cost = 0
-
-            record = {
-                "コード": code,
-                "仕入れ先名": name,
-                "原価一覧の原価": csv_cost,
-                "振替済みの原価": pdf_cost,
-                "_status": "" # internal helper
-            }
-            
-            if pd.isna(row['コード']) or pd.isna(row['pdf_code']):
-                # Code not matching (exists in one but not other)
-                record["_status"] = "unmatched_code"
-                unmatched_code.append(record)
-            elif csv_cost != pdf_cost:
-                # Code matches but cost mismatch
-                record["_status"] = "mismatched_cost"
-                mismatched_cost.append(record)
-            else:
-                # Fully matched
-                record["_status"] = "matched"
-                matched.append(record)
-                
-        # Combine in order: Mismatched Cost -> Unmatched Code -> Matched -> Others (if any logic for others)
-        final_rows = mismatched_cost + unmatched_code + matched
-        
-        # Create Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "マッチング結果"
-        
-        headers = ["コード", "仕入れ先名", "原価一覧の原価", "振替済みの原価"]
-        ws.append(headers)
-        
-        # Fills
-        fill_yellow = PatternFill(start_color="FFFFE0", end_color="FFFFE0", fill_type="solid") # Light Yellow
-        fill_red = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")    # Light Red
-        
-        for row_data in final_rows:
-            row_values = [row_data[h] for h in headers]
-            ws.append(row_values)
-            
-            current_row = ws.max_row
-            status = row_data["_status"]
-            
-            if status == "mismatched_cost":
-                for cell in ws[current_row]:
-                    cell.fill = fill_yellow
-            elif status == "unmatched_code":
-                for cell in ws[current_row]:
-                    cell.fill = fill_red
-                    
-        # Save File
-        # yyyymmdd is dependent on selected CSV.
-        basename = os.path.basename(csv_path)
-        match_date = re.search(r'\d{8}', basename)
-        if match_date:
-            date_str = match_date.group(0)
-        else:
-            from datetime import datetime
-            date_str = datetime.now().strftime("%Y%m%d")
-            
-        output_filename = f"{date_str}マッチング済み.xlsx"
-        
-        # Save to Desktop
-        desktop_path = os.path.join(os.path.expanduser('~'), 'Desktop')
-        output_path = os.path.join(desktop_path, output_filename)
-        
-        wb.save(output_path)
+        finish_run(profile, df_csv, df_pdf, csv_paths, pdf_paths, output_path, state=state, pages=pages,
+                   partial=partial)
         
         # Confirm open
-        if messagebox.askyesno("完了", f"マッチングが完了しました。\n保存先: {output_path}\n\n作成されました。開きますか？"):
+        done = "途中までのPDFでマッチングしました。" if partial else "マッチングが完了しました。"
+        if messagebox.askyesno("完了", f"{done}\n保存先: {output_path}\n\n作成されました。開きますか？"):
             try:
                 os.startfile(output_path)
             except Exception as e:
@@ -258,5 +1868,378 @@ def main():
     except Exception as e:
         messagebox.showerror("エラー", f"予期せぬエラーが発生しました:\n{str(e)}")
 
+def _is_cost_csv(path):
+    # yyyymmdd未払合計.csv; other CSVs in a folder (e.g. batch_summary.csv) are not inputs
+    return path.lower().endswith('.csv') and '未払合計' in os.path.basename(path)
+
+def _is_transfer_pdf(path):
+    return path.lower().endswith('.pdf') and '精算' in os.path.basename(path)
+
+def _collect_inputs(paths):
+    # Files named on the command line are taken by extension; from a folder only
+    # the 未払合計 CSVs and 精算 PDFs, so outputs written there are not picked up
+    csv_files, pdf_files = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            files = [os.path.join(path, name) for name in names]
+            csv_files.extend(file for file in files if _is_cost_csv(file))
+            pdf_files.extend(file for file in files if _is_transfer_pdf(file))
+            continue
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.csv':
+            csv_files.append(path)
+        elif ext == '.pdf':
+            pdf_files.append(path)
+    return csv_files, pdf_files
+
+# pair_inputs() reason for a date with more than one CSV or PDF
+AMBIGUOUS_PAIR = "同じ日付のファイルが複数あります"
+
+def pair_inputs(csv_files, pdf_files):
+    # Pair yyyymmdd未払合計.csv with the 精算 PDF that has the same yyyymmdd.
+    # Returns (pairs, problems); problems are (path, reason) for files that could not be paired.
+    by_date = {}
+    problems = []
+    for kind, files in (('csv', csv_files), ('pdf', pdf_files)):
+        for path in files:
+            date_str = file_date(path)
+            if date_str is None:
+                problems.append((path, "ファイル名に日付 (yyyymmdd) がありません"))
+                continue
+            by_date.setdefault(date_str, {'csv': [], 'pdf': []})[kind].append(path)
+
+    pairs = []
+    for date_str in sorted(by_date):
+        found = by_date[date_str]
+        if len(found['csv']) == 1 and len(found['pdf']) == 1:
+            pairs.append((date_str, found['csv'][0], found['pdf'][0]))
+            continue
+        if not found['csv']:
+            reason = "同じ日付のCSVがありません"
+        elif not found['pdf']:
+            reason = "同じ日付のPDFがありません"
+        else:
+            reason = AMBIGUOUS_PAIR
+        for path in found['csv'] + found['pdf']:
+            problems.append((path, reason))
+    return pairs, problems
+
+def _batch_job(csv_path, pdf_path, output_path, use_cache, profile_mode, aggregate, engine, incremental):
+    # One pair per process, so PDF extraction inside it stays serial
+    return reconcile_files(csv_path, pdf_path, output_path, workers=1, use_cache=use_cache,
+                           profile_mode=profile_mode, aggregate=aggregate, engine=engine, incremental=incremental)
+
+def run_batch(paths, output_dir, jobs=0, use_cache=None, profile_mode=None, aggregate=None, engine=None,
+              incremental=None):
+    import pandas as pd
+    csv_files, pdf_files = _collect_inputs(paths)
+    pairs, problems = pair_inputs(csv_files, pdf_files)
+    os.makedirs(output_dir, exist_ok=True)
+
+    summary = []
+    for path, reason in problems:
+        kind = 'csv' if path.lower().endswith('.csv') else 'pdf'
+        summary.append({'date': file_date(path) or '', kind: path, 'status': 'error', 'message': reason})
+
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(pairs) or 1))) as executor:
+        futures = []
+        for date_str, csv_path, pdf_path in pairs:
+            output_path = os.path.join(output_dir, output_filename(csv_path))
+            future = executor.submit(_batch_job, csv_path, pdf_path, output_path, use_cache, profile_mode, aggregate,
+                                     engine, incremental)
+            futures.append((date_str, csv_path, pdf_path, output_path, future))
+        for date_str, csv_path, pdf_path, output_path, future in futures:
+            row = {'date': date_str, 'csv': csv_path, 'pdf': pdf_path, 'output': output_path}
+            try:
+                row.update(future.result())
+                row.update(status='ok', message='')
+            except Exception as e:
+                row.update(output='', status='error', message=str(e).replace('\n', ' '))
+            summary.append(row)
+
+    columns = ['date', 'csv', 'pdf', 'output', 'status'] + STATUS_ORDER + ['message']
+    df_summary = pd.DataFrame(summary, columns=columns).fillna({'date': '', 'csv': '', 'pdf': '', 'output': ''})
+    df_summary[STATUS_ORDER] = df_summary[STATUS_ORDER].astype('Int64')
+    df_summary = df_summary.sort_values(['date', 'csv', 'pdf'], kind='stable')
+    summary_path = os.path.join(output_dir, "batch_summary.csv")
+    df_summary.to_csv(summary_path, index=False, encoding='utf-8-sig')
+    return df_summary, summary_path
+
+# Watch-folder mode settings
+# MACHING_WATCH_INTERVAL: seconds between two scans of the drop folder
+WATCH_INTERVAL = float(os.environ.get("MACHING_WATCH_INTERVAL", "5"))
+# Processed pairs are logged here (in the output folder), one JSON object per line
+WATCH_LOG_NAME = "watch_processed.jsonl"
+
+def _read_watch_log(log_path):
+    # (csv sha256, pdf sha256) of every pair already processed
+    done = set()
+    if not os.path.exists(log_path):
+        return done
+    with open(log_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'csv_sha256' in entry:
+                done.add((entry['csv_sha256'], entry['pdf_sha256']))
+    return done
+
+class FolderWatcher:
+    # Polls a drop folder for yyyymmdd未払合計.csv / 精算 PDF pairs and
+    # reconciles each pair once, in this process, with reconcile_files().
+    # A file counts as complete when its size and mtime did not change since
+    # the previous scan, so files that are still being copied are left alone.
+    # Pairs are identified by content hash, so a renamed or re-copied file is
+    # not processed again, while a file replaced with new content is.
+    def __init__(self, folder, output_dir, use_cache=None, aggregate=None, engine=None):
+        self.folder = folder
+        self.output_dir = output_dir
+        self.log_path = os.path.join(output_dir, WATCH_LOG_NAME)
+        self.options = {'use_cache': use_cache, 'aggregate': aggregate, 'engine': engine}
+        self.done = _read_watch_log(self.log_path)
+        self.signatures = {}
+        self.hashes = {}
+        # Content hashes of the file sets already reported as ambiguous
+        self.ambiguous = set()
+
+    def _complete_files(self):
+        complete = []
+        signatures = {}
+        for name in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            signatures[path] = signature
+            if stat.st_size > 0 and self.signatures.get(path) == signature:
+                complete.append(path)
+        self.signatures = signatures
+        return complete
+
+    def _sha256(self, path):
+        # Hash each file version once, not on every scan
+        signature = self.signatures[path]
+        cached = self.hashes.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, _file_sha256(path))
+            self.hashes[path] = cached
+        return cached[1]
+
+    def scan(self):
+        # One pass over the folder. Returns the log entries of the pairs processed.
+        files = self._complete_files()
+        csv_files = [p for p in files if _is_cost_csv(p)]
+        pdf_files = [p for p in files if _is_transfer_pdf(p)]
+        # Unpaired files are not an error here: the other file may not have
+        # arrived yet. Several files for one date are, as they never pair up.
+        pairs, problems = pair_inputs(csv_files, pdf_files)
+        entries = []
+        ambiguous = {}
+        for path, reason in problems:
+            if reason == AMBIGUOUS_PAIR:
+                ambiguous.setdefault(file_date(path), []).append(path)
+        for date_str, paths in sorted(ambiguous.items()):
+            key = tuple(sorted(self._sha256(path) for path in paths))
+            if key not in self.ambiguous:
+                entries.append(self._report_ambiguous(date_str, paths, key))
+        for date_str, csv_path, pdf_path in pairs:
+            key = (self._sha256(csv_path), self._sha256(pdf_path))
+            if key in self.done:
+                continue
+            entries.append(self._process(date_str, csv_path, pdf_path, key))
+        return entries
+
+    def _report_ambiguous(self, date_str, paths, key):
+        # Logged once per set of files; reported again when one of them is
+        # removed, replaced or joined by another
+        from datetime import datetime
+        entry = {'processed_at': datetime.now().isoformat(timespec='seconds'), 'date': date_str,
+                 'csv': paths[0], 'pdf': '', 'files': paths, 'status': 'ambiguous',
+                 'message': f"{AMBIGUOUS_PAIR}: " + ", ".join(os.path.basename(path) for path in paths)}
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.ambiguous.add(key)
+        return entry
+
+    def _process(self, date_str, csv_path, pdf_path, key):
+        from datetime import datetime
+        output_path = os.path.join(self.output_dir, output_filename(csv_path))
+        entry = {'processed_at': datetime.now().isoformat(timespec='seconds'), 'date': date_str,
+                 'csv': csv_path, 'pdf': pdf_path, 'csv_sha256': key[0], 'pdf_sha256': key[1]}
+        t0 = time.perf_counter()
+        try:
+            counts = reconcile_files(csv_path, pdf_path, output_path, **self.options)
+            entry.update(output=output_path, status='ok', message='', **counts)
+        except Exception as e:
+            # Logged as processed too: a broken pair is not retried until one of its files changes
+            entry.update(output='', status='error', message=str(e).replace('\n', ' '))
+        entry['seconds'] = round(time.perf_counter() - t0, 3)
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.done.add(key)
+        return entry
+
+def watch_folder(folder, output_dir, interval=None, use_cache=None, aggregate=None, engine=None):
+    # Resident mode: the heavy modules are imported once, then every pair
+    # dropped into the folder is reconciled without a new process start.
+    if interval is None:
+        interval = WATCH_INTERVAL
+    os.makedirs(output_dir, exist_ok=True)
+    _import_heavy_modules()
+    watcher = FolderWatcher(folder, output_dir, use_cache=use_cache, aggregate=aggregate, engine=engine)
+    print(f"watching {folder} every {interval:g}s (Ctrl+C to stop), log: {watcher.log_path}")
+    try:
+        while True:
+            for entry in watcher.scan():
+                target = os.path.basename(entry['csv'])
+                if entry['status'] == 'ok':
+                    print(f"[ok]    {entry['date']} {target} -> {entry['output']} ({entry['seconds']:.1f}s)")
+                else:
+                    print(f"[{entry['status']}] {entry['date']} {target}: {entry['message']}", file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def _history_cli(args):
+    if args.history_command == 'export':
+        count = export_history(args.output, since=args.since, until=args.until, code=args.code, status=args.status)
+        print(f"{count} rows exported to {args.output}")
+        return 0
+    if args.code:
+        df = code_history(args.code)
+    else:
+        df = query_history(args.status, months=args.months, min_months=args.min_months, until=args.until)
+    if df.empty:
+        print("該当なし")
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+def cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="Maching", description="原価CSVと振替PDFの照合 (コマンドライン版)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help="複数のCSV/PDFペアをまとめて照合する")
+    batch.add_argument('paths', nargs='+', help="CSV/PDFファイル、またはそれらを含むフォルダ")
+    batch.add_argument('-o', '--output-dir', default=DESKTOP_DIR, help="出力先フォルダ (既定: デスクトップ)")
+    batch.add_argument('-j', '--jobs', type=int, default=0, help="並列数 (0 = CPU数)")
+    batch.add_argument('--no-cache', action='store_true', help="PDF抽出キャッシュを使わない")
+    batch.add_argument('--aggregate', action='store_true', default=None,
+                       help="同じコードの行を合算してから照合する (重複コードの確認用)")
+    batch.add_argument('--profile', nargs='?', const='1', choices=['1', 'cprofile'],
+                       help="処理時間レポート (.timing.json) を出力する。cprofile でプロファイル (.prof) も出力")
+    batch.add_argument('--incremental', action='store_true', default=None,
+                       help="前回の結果から変わったページ・コードだけを処理し、「前回からの変更」シートを追加する")
+    batch.add_argument('--engine', choices=PDF_ENGINES,
+                       help="PDFの読み取り方式 (words = 従来方式, chars = 文字単位の高速方式。既定: MACHING_PDF_ENGINE)")
+
+    merge = subparsers.add_parser('merge', help="複数のCSV/PDFをまとめて1回で照合する (分割されたファイル用)")
+    merge.add_argument('--csv', nargs='+', required=True, help="原価データCSV (複数指定可)")
+    merge.add_argument('--pdf', nargs='+', required=True, help="振替済みデータPDF (複数指定可)")
+    merge.add_argument('-o', '--output', help="出力ファイル (既定: デスクトップの yyyymmddマッチング済み.xlsx)")
+    merge.add_argument('-j', '--jobs', type=int, default=0, help="PDFの並列数 (0 = CPU数)")
+    merge.add_argument('--no-cache', action='store_true', help="PDF抽出キャッシュを使わない")
+    merge.add_argument('--engine', choices=PDF_ENGINES, help="PDFの読み取り方式 (words / chars)")
+    merge.add_argument('--profile', nargs='?', const='1', choices=['1', 'cprofile'],
+                       help="処理時間レポート (.timing.json) を出力する。cprofile でプロファイル (.prof) も出力")
+
+    sales = subparsers.add_parser('sales', help="予約番号単位の売上データとPDFの原価を照合する")
+    sales.add_argument('sales_csv', help="売上データCSV (予約番号, 売上金額, 原価, 斡旋手数料, 利益, …)")
+    sales.add_argument('pdf', nargs='+', help="振替済みデータPDF (複数指定可)")
+    sales.add_argument('-o', '--output', help="出力ファイル (既定: デスクトップの yyyymmdd売上照合.xlsx)")
+    sales.add_argument('--code-column', help="原価を集計する列 (既定: MACHING_SALES_CODE または 代理店コード)")
+    sales.add_argument('--chunksize', type=int, help="一度に読み込む行数 (既定: 200000)")
+    sales.add_argument('--no-cache', action='store_true', help="PDF抽出キャッシュを使わない")
+    sales.add_argument('--engine', choices=PDF_ENGINES, help="PDFの読み取り方式 (words / chars)")
+
+    watch = subparsers.add_parser('watch', help="フォルダを監視し、CSV/PDFのペアが揃うたびに照合する")
+    watch.add_argument('folder', help="監視するフォルダ")
+    watch.add_argument('-o', '--output-dir', default=DESKTOP_DIR, help="出力先フォルダ (既定: デスクトップ)")
+    watch.add_argument('--interval', type=float, default=None,
+                       help="監視間隔 (秒、既定: MACHING_WATCH_INTERVAL または 5)")
+    watch.add_argument('--no-cache', action='store_true', help="PDF抽出キャッシュを使わない")
+    watch.add_argument('--aggregate', action='store_true', default=None,
+                       help="同じコードの行を合算してから照合する (重複コードの確認用)")
+    watch.add_argument('--engine', choices=PDF_ENGINES, help="PDFの読み取り方式 (words / chars)")
+
+    history = subparsers.add_parser('history', help="照合履歴の検索・出力")
+    history_commands = history.add_subparsers(dest='history_command', required=True)
+    query = history_commands.add_parser('query', help="指定した状態が続くコード、または1コードの履歴を表示する")
+    query.add_argument('--status', choices=STATUS_ORDER, default='mismatched_cost', help="対象の状態")
+    query.add_argument('--months', type=int, default=6, help="対象期間 (直近の月数)")
+    query.add_argument('--min-months', type=int, default=3, help="この月数以上該当したコードを表示")
+    query.add_argument('--until', help="期間の最終月 (yyyymm、既定: 今月)")
+    query.add_argument('--code', help="このコードの全履歴を表示する")
+    export = history_commands.add_parser('export', help="照合履歴をCSVに出力する")
+    export.add_argument('output', help="出力先CSVファイル")
+    export.add_argument('--since', help="開始日 (yyyymmdd)")
+    export.add_argument('--until', help="終了日 (yyyymmdd)")
+    export.add_argument('--code', help="コードで絞り込む")
+    export.add_argument('--status', choices=STATUS_ORDER, help="状態で絞り込む")
+
+    subparsers.add_parser('clear-cache', help="PDF抽出キャッシュを削除する")
+
+    args = parser.parse_args(argv)
+    if args.command == 'clear-cache':
+        print(f"{clear_pdf_cache()} cache entries removed")
+        return 0
+    if args.command == 'history':
+        return _history_cli(args)
+    if args.command == 'merge':
+        output_path = args.output or os.path.join(DESKTOP_DIR, output_filename(latest_input(args.csv)))
+        try:
+            counts = reconcile_files(args.csv, args.pdf, output_path, workers=args.jobs,
+                                     use_cache=False if args.no_cache else None, profile_mode=args.profile,
+                                     engine=args.engine)
+        except Exception as e:
+            print(f"[error] {e}", file=sys.stderr)
+            return 1
+        print(f"[ok]    {output_path} " + " ".join(f"{status}={count}" for status, count in counts.items()))
+        return 0
+    if args.command == 'sales':
+        if args.output:
+            output_path = args.output
+        else:
+            from datetime import datetime
+            date_str = file_date(args.sales_csv) or datetime.now().strftime("%Y%m%d")
+            output_path = os.path.join(DESKTOP_DIR, f"{date_str}売上照合.xlsx")
+        try:
+            summary = reconcile_sales(args.sales_csv, args.pdf, output_path, code_column=args.code_column,
+                                      chunksize=args.chunksize, use_cache=False if args.no_cache else None,
+                                      engine=args.engine)
+        except Exception as e:
+            print(f"[error] {e}", file=sys.stderr)
+            return 1
+        print(f"[ok]    {output_path} " + " ".join(f"{key}={value}" for key, value in summary.items()))
+        return 0
+    if args.command == 'watch':
+        return watch_folder(args.folder, args.output_dir, interval=args.interval,
+                            use_cache=False if args.no_cache else None, aggregate=args.aggregate,
+                            engine=args.engine)
+
+    df_summary, summary_path = run_batch(args.paths, args.output_dir, jobs=args.jobs,
+                                         use_cache=False if args.no_cache else None, profile_mode=args.profile,
+                                         aggregate=args.aggregate, engine=args.engine, incremental=args.incremental)
+    for row in df_summary.itertuples(index=False):
+        target = os.path.basename(row.csv or row.pdf)
+        if row.status == 'ok':
+            print(f"[ok]    {row.date} {target} -> {row.output}")
+        else:
+            print(f"[error] {row.date} {target}: {row.message}", file=sys.stderr)
+    print(f"summary: {summary_path}")
+    return 0 if len(df_summary) and (df_summary['status'] == 'ok').all() else 1
+
 if __name__ == "__main__":
+    # Required for ProcessPoolExecutor in the PyInstaller one-file build
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     main()
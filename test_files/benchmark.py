@@ -0,0 +1,295 @@
+"""Benchmark for the PDF extraction, reconciliation and Excel output stages.
+
+Generates a synthetic 出発日精算 PDF (科目別合計 section) and a matching
+未払合計 CSV, then times extract_pdf_data, reconcile and write_workbook
+separately and prints the results as JSON.
+
+    uv run python test_files/benchmark.py --pages 200 --repeat 3 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+# Geometry of the real printout (A4 landscape, 9pt text)
+PAGE_HEIGHT = 728.52
+FONT_SIZE = 8.98
+BLOCK_WIDTH = 325.5
+FIRST_LINE_TOP = 130.0
+LINE_STEP = 16.2
+LINES_PER_PAGE = 35
+NAME_MAX_WIDTH = 14 * FONT_SIZE
+
+KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+NAME_WORDS = ["ホテル", "リゾート", "レンタカー", "観光", "バス", "株式会社", "旅館", "センター", "沖縄", "札幌", "東京", "ツアーズ"]
+
+
+def _char_width(ch):
+    # Half-width for ASCII and half-width katakana, full-width otherwise
+    return FONT_SIZE * (0.5 if ord(ch) < 0x80 or 0xFF61 <= ord(ch) <= 0xFF9F else 1.0)
+
+
+def _text_width(text):
+    return sum(_char_width(ch) for ch in text)
+
+
+def write_pdf(path, pages, width):
+    # Minimal PDF writer: one non-embedded Japanese CID font (UniJIS-UCS2-H),
+    # half-width glyphs 500/1000 em wide like the DJ printout. pages is a list
+    # of [(x0, top, text), ...].
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(None)
+    descendant = add(None)
+    descriptor = add(b"<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4 /FontBBox [-92 -250 1010 922]"
+                     b" /ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 737 /StemV 80 >>")
+    objects[font - 1] = (b"<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5 /Encoding /UniJIS-UCS2-H"
+                         b" /DescendantFonts [%d 0 R] >>" % descendant)
+    objects[descendant - 1] = (b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5"
+                               b" /CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >>"
+                               b" /FontDescriptor %d 0 R /DW 1000 /W [1 632 500] >>" % descriptor)
+    pages_id = add(None)
+
+    kids = []
+    for items in pages:
+        ops = [b"BT", b"/F1 %.2f Tf" % FONT_SIZE]
+        for x0, top, text in items:
+            y = PAGE_HEIGHT - top - FONT_SIZE * 0.88
+            ops.append(b"1 0 0 1 %.2f %.2f Tm <%s> Tj" % (x0, y, text.encode('utf-16-be').hex().encode()))
+        ops.append(b"ET")
+        data = zlib.compress(b"\n".join(ops))
+        contents = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Resources << /Font << /F1 %d 0 R >> >>"
+                        b" /Contents %d 0 R >>" % (pages_id, width, PAGE_HEIGHT, font, contents)))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def _page_header(page_number, n_pages):
+    return [
+        (467.0, 28.3, "≪出発日精算"),
+        (567.3, 28.3, "合計票≫"),
+        (851.8, 28.3, "作成日:25/12/11"),
+        (923.6, 28.3, "PAGE:"),
+        (959.6, 28.3, f"{page_number}/"),
+        (982.1, 28.3, str(n_pages)),
+        (42.5, 42.3, "【営業所】[32]"),
+        (42.5, 55.9, "【帰着日】25年11月01日から25年11月30日まで"),
+    ]
+
+
+def _filler_page(rng, page_number, n_pages):
+    # Page before the 科目別合計 section (仕分用合計 table)
+    items = _page_header(page_number, n_pages) + [(28.3, 99.0, "仕分用合計")]
+    for i in range(LINES_PER_PAGE):
+        top = FIRST_LINE_TOP + i * LINE_STEP
+        items.append((31.9, top, str(2221 + i)))
+        items.append((90.0, top, "国内主催旅行"))
+        items.append((220.0, top, rng.choice(["ANA", "JAL", "APJ", "SKY"])))
+        items.append((300.0, top, f"{rng.randint(0, 9_999_999):,}"))
+    return items
+
+
+def _section_page(line_records, blocks, page_number, n_pages):
+    items = _page_header(page_number, n_pages) + [(28.3, 99.0, main.SECTION_MARKER)]
+    for b in range(blocks):
+        offset = b * BLOCK_WIDTH
+        items += [(35.9 + offset, 113.7, "仕入先"), (127.8 + offset, 113.7, "仕入先"),
+                  (238.6 + offset, 113.7, "原価"), (304.4 + offset, 113.7, "COM")]
+    for i, line in enumerate(line_records):
+        top = FIRST_LINE_TOP + i * LINE_STEP
+        for b, (code, name_words, cost, com) in enumerate(line):
+            offset = b * BLOCK_WIDTH
+            items.append((31.9 + offset, top, code))
+            x = 74.3 + offset
+            for word in name_words:
+                items.append((x, top, word))
+                x += _text_width(word) + FONT_SIZE
+            cost_text, com_text = f"{cost:,}", f"{com:,}"
+            items.append((279.4 + offset - _text_width(cost_text), top, cost_text))
+            items.append((336.0 + offset - _text_width(com_text), top, com_text))
+    return items
+
+
+def _code(i):
+    letters = ""
+    n = i // 100
+    for _ in range(3):
+        n, r = divmod(n, 26)
+        letters = chr(ord('A') + r) + letters
+    return f"{i % 100:02d}{letters}"
+
+
+def _name_words(rng, n_words):
+    words = []
+    width = 0.0
+    for _ in range(n_words):
+        word = rng.choice(NAME_WORDS) + "".join(rng.choice(KANA) for _ in range(rng.randint(0, 3)))
+        # The printout truncates names to the column width
+        if width + _text_width(word) > NAME_MAX_WIDTH:
+            break
+        words.append(word)
+        width += _text_width(word) + FONT_SIZE
+    return words or [rng.choice(NAME_WORDS)]
+
+
+def generate(directory, pages=20, filler_pages=2, blocks=3, name_words=2,
+             mismatch_ratio=0.05, orphan_ratio=0.05, seed=0, trailing_pages=0):
+    """Write yyyymmdd未払合計.csv and a 精算 PDF into directory.
+
+    Returns (csv_path, pdf_path, expected) where expected holds the status
+    counts reconcile() should produce.
+    """
+    import pandas as pd
+    rng = random.Random(seed)
+    n_records = pages * LINES_PER_PAGE * blocks
+
+    pdf_records = []
+    for i in range(n_records):
+        cost = rng.randint(1_000, 5_000_000)
+        pdf_records.append((_code(i), _name_words(rng, name_words), cost, cost // 10))
+
+    csv_rows = []
+    expected = {status: 0 for status in main.STATUS_ORDER}
+    for code, words, cost, com in pdf_records:
+        r = rng.random()
+        if r < orphan_ratio:
+            # Only in the PDF
+            expected["unmatched_code"] += 1
+            continue
+        if r < orphan_ratio + mismatch_ratio:
+            csv_cost = cost + rng.randint(1, 10_000)
+            expected["mismatched_cost"] += 1
+        else:
+            csv_cost = cost
+            expected["matched"] += 1
+        csv_rows.append((code, "".join(words), csv_cost, com, 0, csv_cost - com))
+    # Codes only in the CSV
+    for i in range(int(n_records * orphan_ratio)):
+        cost = rng.randint(1_000, 500_000)
+        csv_rows.append((f"ZZ{i:04d}", "".join(_name_words(rng, name_words)), cost, 0, 0, cost))
+        expected["unmatched_code"] += 1
+    rng.shuffle(csv_rows)
+
+    total_pages = filler_pages + pages + trailing_pages
+    page_items = [_filler_page(rng, p + 1, total_pages) for p in range(filler_pages)]
+    per_page = LINES_PER_PAGE * blocks
+    for p in range(pages):
+        chunk = pdf_records[p * per_page:(p + 1) * per_page]
+        lines = [chunk[i:i + blocks] for i in range(0, len(chunk), blocks)]
+        page_items.append(_section_page(lines, blocks, filler_pages + p + 1, total_pages))
+    for p in range(trailing_pages):
+        page_items.append(_filler_page(rng, filler_pages + pages + p + 1, total_pages))
+
+    pdf_path = os.path.join(directory, "20251231パッケージ・チョイス出発日精算データ抽出.pdf")
+    csv_path = os.path.join(directory, "20251231未払合計.csv")
+    write_pdf(pdf_path, page_items, width=max(1031.76, 56.6 + blocks * BLOCK_WIDTH))
+    columns = ["コード", "仕入先名", "合計原価", "手数料", "ハイビー会費", "支払計"]
+    pd.DataFrame(csv_rows, columns=columns).to_csv(csv_path, index=False, encoding='cp932')
+    return csv_path, pdf_path, expected
+
+
+def _time(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - t0)
+    return result, {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "runs": timings,
+    }
+
+
+def run(args):
+    import pandas
+    import pdfplumber
+    with tempfile.TemporaryDirectory() as directory:
+        t0 = time.perf_counter()
+        csv_path, pdf_path, expected = generate(
+            directory, pages=args.pages, filler_pages=args.filler_pages, blocks=args.blocks,
+            name_words=args.name_words, mismatch_ratio=args.mismatch_ratio,
+            orphan_ratio=args.orphan_ratio, seed=args.seed, trailing_pages=args.trailing_pages)
+        generate_time = time.perf_counter() - t0
+
+        stages = {}
+        df_pdf, stages["extract_pdf_data"] = _time(
+            lambda: main.extract_pdf_data(pdf_path, workers=args.workers, engine=args.engine), args.repeat)
+        df_csv, stages["read_csv_data"] = _time(lambda: main.read_csv_data(csv_path), args.repeat)
+        result, stages["reconcile"] = _time(lambda: main.reconcile(df_csv, df_pdf), args.repeat)
+        xlsx_path = os.path.join(directory, "out.xlsx")
+        _, stages["write_workbook"] = _time(lambda: main.write_workbook(result, xlsx_path), args.repeat)
+
+        counts = result["_status"].value_counts()
+        actual = {status: int(counts.get(status, 0)) for status in main.STATUS_ORDER}
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "parser_version": main.PARSER_VERSION,
+            "python": platform.python_version(),
+            "pandas": pandas.__version__,
+            "pdfplumber": pdfplumber.__version__,
+            "params": vars(args),
+            "pdf_bytes": os.path.getsize(pdf_path),
+            "generate_seconds": generate_time,
+            "records": {"pdf": len(df_pdf), "csv": len(df_csv), "result": len(result)},
+            "status_expected": expected,
+            "status_actual": actual,
+            "ok": expected == actual,
+            "stages": stages,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=20, help="科目別合計 pages")
+    parser.add_argument('--filler-pages', type=int, default=2, help="pages before the 科目別合計 section")
+    parser.add_argument('--trailing-pages', type=int, default=0, help="pages after the 科目別合計 section")
+    parser.add_argument('--blocks', type=int, default=3, help="suppliers per line")
+    parser.add_argument('--name-words', type=int, default=2, help="words per supplier name")
+    parser.add_argument('--mismatch-ratio', type=float, default=0.05)
+    parser.add_argument('--orphan-ratio', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=1, help="extract_pdf_data workers (0 = one per CPU)")
+    parser.add_argument('--engine', choices=main.PDF_ENGINES, default=main.PDF_ENGINE,
+                        help="extract_pdf_data engine (words or chars)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="append the JSON result to this file (one object per line)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(text + "\n")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report["ok"] else 1)
@@ -0,0 +1,25 @@
+"""Extract PDFs with both engines ("words" and "chars") and report any difference.
+
+    uv run python test_files/compare_engines.py data/*.pdf
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import extract_pdf_data
+
+def compare(pdf_path):
+    frames = {engine: extract_pdf_data(pdf_path, workers=1, engine=engine).reset_index(drop=True)
+              for engine in ("words", "chars")}
+    words, chars = frames["words"], frames["chars"]
+    if words.astype(object).equals(chars.astype(object)):
+        print(f"[same] {pdf_path}: {len(words)} records")
+        return True
+    print(f"[diff] {pdf_path}: words {len(words)} records, chars {len(chars)} records")
+    merged = words.merge(chars, how='outer', indicator=True)
+    print(merged[merged['_merge'] != 'both'].to_string())
+    return False
+
+if __name__ == "__main__":
+    results = [compare(path) for path in sys.argv[1:]]
+    sys.exit(0 if results and all(results) else 1)